@@ -0,0 +1,7 @@
+# Runs before main.py: select the A/B firmware slot, see slots.py
+try:
+    import slots
+    slots.boot()
+except Exception as e:
+    # Run whatever main.py is in the root
+    print("slot selection failed:", repr(e))
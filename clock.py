@@ -0,0 +1,141 @@
+import asyncio
+import machine
+import time
+from time import ticks_ms, ticks_diff
+
+# Offsets above STEP_MS are stepped, smaller ones are slewed in at SLEW_PPM
+STEP_MS = 128
+SLEW_PPM = 500
+# Largest drift we believe a crystal has
+MAX_PPM = 200
+# Error the sync interval is adapted to: doubled while the unexplained error
+# of a sync stays under BOUND_MS / 2, halved when it exceeds BOUND_MS.
+BOUND_MS = 50
+MIN_POLL = 64            # seconds
+MAX_POLL = 4 * 3600
+# Syncs closer together than this don't update the drift, network jitter
+# would dominate the estimate
+DRIFT_SPAN = 256
+# Rebase well within the ticks_ms half period (6 days)
+REBASE_MS = 1 << 28
+
+
+class Clock:
+    """ Disciplined wall clock on top of lib/ntptime.
+
+        Time is kept as an anchor (ticks_ms, us since the epoch) that is
+        advanced with the estimated drift of the crystal. Small NTP offsets
+        are slewed in at no more than SLEW_PPM, large ones (and the first
+        sync) step the clock. The RTC is only rewritten when its second no
+        longer matches, so time.time() and localtime() follow without the
+        constant steps of a plain settime(). The RTC runs on UTC."""
+
+    def __init__(self):
+        self.synced = False
+        self.offset_us = 0     # last measured offset, server - clock
+        self.delay_us = 0      # round trip of that sample
+        self.ppm = 0.0         # drift estimate, positive = crystal is slow
+        self.interval = MIN_POLL
+        self.next_sync = 0     # time.time() of the next planned sync
+        self.syncs = 0
+        self.steps = 0
+        self.failures = 0
+        self.rtc_writes = 0
+        self._anchor = ticks_ms()
+        self._base_us = int(time.time()) * 1000000
+        self._slew_us = 0      # correction still to be slewed in
+        self._last_us = 0      # clock time of the last sync
+
+    def _at(self, e_ms):
+        # Clock time e_ms after the anchor, and the part of the slew used
+        us = e_ms * 1000
+        room = us * SLEW_PPM // 1000000
+        s = max(-room, min(room, self._slew_us))
+        return self._base_us + us + int(us * self.ppm / 1000000) + s, s
+
+    def _rebase(self):
+        now = ticks_ms()
+        self._base_us, s = self._at(ticks_diff(now, self._anchor))
+        self._slew_us -= s
+        self._anchor = now
+
+    def now_us(self):
+        e = ticks_diff(ticks_ms(), self._anchor)
+        if e > REBASE_MS:
+            self._rebase()
+            e = 0
+        return self._at(e)[0]
+
+    def update(self, offset_us, delay_us):
+        """ Take an NTP sample. Returns True when the clock was stepped."""
+        self._rebase()
+        self.offset_us = offset_us
+        self.delay_us = delay_us
+        self.syncs += 1
+        # The part of the offset that the pending slew doesn't explain is
+        # drift accumulated since the last sync
+        err = offset_us - self._slew_us
+        span = self._base_us - self._last_us
+        if self.synced and span >= DRIFT_SPAN * 1000000:
+            ppm = self.ppm + err * 1000000 / span / 2
+            self.ppm = max(-MAX_PPM, min(MAX_PPM, ppm))
+        stepped = not self.synced or abs(offset_us) > STEP_MS * 1000
+        if stepped:
+            self._base_us += offset_us
+            self._slew_us = 0
+            self.steps += 1
+        else:
+            self._slew_us = offset_us
+        if abs(err) < BOUND_MS * 500:
+            self.interval = min(self.interval * 2, MAX_POLL)
+        elif abs(err) > BOUND_MS * 1000:
+            self.interval = max(self.interval // 2, MIN_POLL)
+        self.synced = True
+        self._last_us = self._base_us
+        self.next_sync = self._base_us // 1000000 + self.interval
+        return stepped
+
+    def missed(self):
+        """ No server answered: try again after MIN_POLL."""
+        self.failures += 1
+        self.next_sync = self.now_us() // 1000000 + MIN_POLL
+
+    def wait(self):
+        """ Seconds until the next planned sync."""
+        return max(0, self.next_sync - self.now_us() // 1000000)
+
+    async def sync(self):
+        """ Query the NTP servers and discipline the clock. Returns
+            (offset_us, delay_us, server, stepped) or None."""
+        import ntptime  # not needed until the first sync
+        ntptime.now_us = self.now_us
+        best = await ntptime.sample()
+        if best is None:
+            self.missed()
+            return None
+        stepped = self.update(best[0], best[1])
+        await self.align_rtc()
+        return best + (stepped,)
+
+    async def align_rtc(self):
+        """ Rewrite the RTC if its second differs from the clock."""
+        us = self.now_us()
+        # Compare half way through a second, write on the next full one
+        await asyncio.sleep_ms((1500000 - us % 1000000) % 1000000 // 1000)
+        t = self.now_us() // 1000000
+        if int(time.time()) == t:
+            return
+        await asyncio.sleep_ms(1000 - self.now_us() % 1000000 // 1000)
+        tm = time.gmtime(t + 1)
+        machine.RTC().datetime((tm[0], tm[1], tm[2], tm[6] + 1, tm[3], tm[4], tm[5], 0))
+        self.rtc_writes += 1
+
+    def state(self):
+        return {
+            "offset_ms": self.offset_us // 1000,
+            "delay_ms": self.delay_us // 1000,
+            "drift_ppm": round(self.ppm, 2),
+            "interval": self.interval,
+            "next_sync": self.next_sync,
+            "steps": self.steps,
+        }
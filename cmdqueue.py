@@ -0,0 +1,80 @@
+import asyncio
+from time import ticks_ms, ticks_diff
+
+STOP = "stop"
+# Pending commands that are superseded by their opposite
+OPPOSITE = {"open": "close", "close": "open"}
+
+
+class CmdQueue:
+    """ Bounded command queue between sub_cb() and the relays.
+
+        stop jumps the queue and discards any pending open/close, a repeated
+        command is coalesced with the one already waiting. put() never blocks,
+        consumers use 'async for cmd in queue' and wake up as soon as a
+        command arrives."""
+
+    def __init__(self, size=4):
+        self._q = []  # [name, ticks_ms received]
+        self._size = size
+        self._evt = asyncio.Event()
+        # counters
+        self.received = 0
+        self.coalesced = 0
+        self.cancelled = 0
+        self.drops = 0
+        self.max_depth = 0
+        self.latency_ms = 0  # last command-to-actuation time
+        self.max_latency_ms = 0
+
+    def __len__(self):
+        return len(self._q)
+
+    def put(self, name):
+        q = self._q
+        self.received += 1
+        if name == STOP:
+            # Discard everything pending, a stop already waiting stays
+            stop = None
+            for cmd in q:
+                if cmd[0] == STOP:
+                    stop = cmd
+            self.cancelled += len(q) - (stop is not None)
+            del q[:]
+            if stop:
+                q.append(stop)
+                self.coalesced += 1
+                return False
+        else:
+            for cmd in q:
+                if cmd[0] == name:
+                    self.coalesced += 1
+                    return False
+            other = OPPOSITE.get(name)
+            for i in range(len(q)):
+                if q[i][0] == other:
+                    del q[i]
+                    self.cancelled += 1
+                    break
+            if len(q) >= self._size:
+                self.drops += 1
+                return False
+
+        q.append((name, ticks_ms()))
+        if len(q) > self.max_depth:
+            self.max_depth = len(q)
+        self._evt.set()
+        return True
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self._q:
+            self._evt.clear()
+            await self._evt.wait()
+        name, t = self._q.pop(0)
+        self.latency_ms = ticks_diff(ticks_ms(), t)
+        if self.latency_ms > self.max_latency_ms:
+            self.max_latency_ms = self.latency_ms
+        return name
@@ -0,0 +1,143 @@
+import json
+import os
+from array import array
+from time import ticks_ms, ticks_diff
+
+# A travel time above SLOW_FACTOR times the baseline raises an alert. The
+# baseline is the mean travel time of the first BASELINE cycles, frozen
+# after that so a gate that slowly gets slower doesn't raise its own bar.
+# The baseline (and the cycles learned towards it) is kept in BASEFILE so it
+# survives a reboot; delete the file to learn it again, e.g. after motor work.
+SLOW_FACTOR = 1.5
+BASELINE = 10
+BASEFILE = '/cycles.json'
+
+
+class Stats:
+    """ Running count/mean/variance (Welford) and a fixed-bin histogram for
+        percentiles, constant memory however many samples are added."""
+
+    def __init__(self, bin_ms, bins=60):
+        self.bin_ms = bin_ms
+        self.hist = array('H', [0] * bins)  # last bin counts everything above
+        self.n = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.min = 0
+        self.max = 0
+
+    def add(self, ms):
+        self.n += 1
+        d = ms - self.mean
+        self.mean += d / self.n
+        self._m2 += d * (ms - self.mean)
+        if self.n == 1 or ms < self.min:
+            self.min = ms
+        if ms > self.max:
+            self.max = ms
+        i = min(ms // self.bin_ms, len(self.hist) - 1)
+        if self.hist[i] < 0xffff:
+            self.hist[i] += 1
+
+    def variance(self):
+        return self._m2 / (self.n - 1) if self.n > 1 else 0.0
+
+    def percentile(self, p):
+        """ Upper edge of the bin holding the p-th percentile, in ms."""
+        if not self.n:
+            return None
+        want = self.n * p / 100
+        seen = 0
+        for i, c in enumerate(self.hist):
+            seen += c
+            if seen >= want:
+                return (i + 1) * self.bin_ms
+        return len(self.hist) * self.bin_ms
+
+    def summary(self):
+        return {
+            "n": self.n,
+            "mean": int(self.mean),
+            "sd": int(self.variance() ** 0.5),
+            "min": self.min,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+        }
+
+
+class Cycles:
+    """ Times every gate movement from the command and the end position
+        sensors: command -> leaving the end position (react) and leaving
+        -> reaching the other end position (travel). All times are the
+        ticks_ms of the relay pulse and the debounced sensor edges."""
+
+    def __init__(self, slow_factor=SLOW_FACTOR, baseline=BASELINE):
+        self.react = Stats(100)    # 0..6 s in 100 ms bins
+        self.travel = Stats(1000)  # 0..60 s in 1 s bins
+        self.slow_factor = slow_factor
+        self.baseline = baseline
+        self.base = None    # baseline travel time, ms
+        self._learn = [0, 0]  # cycles and total ms towards the baseline
+        self.slow = 0
+        self.alert = None   # alert text for the last completed cycle
+        self._cmd = None    # ticks_ms of the pending command
+        self._start = None  # ticks_ms the gate left an end position
+        self._load()
+
+    def _load(self):
+        try:
+            with open(BASEFILE) as f:
+                saved = json.load(f)
+            self.base = saved['base']
+            self._learn = saved['learn']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def _save(self):
+        try:
+            with open(BASEFILE + '.tmp', 'w') as f:
+                json.dump({'base': self.base, 'learn': self._learn}, f)
+            os.rename(BASEFILE + '.tmp', BASEFILE)
+        except OSError:
+            pass
+
+    def command(self, name, t=None):
+        if name == "stop":
+            # An interrupted movement is not a cycle
+            self._cmd = self._start = None
+        else:
+            self._cmd = ticks_ms() if t is None else t
+
+    def sensor(self, name, value, t):
+        """ Feed an open/close transition. Returns the travel time when it
+            completes a cycle, else None. 'alert' is set when that cycle was
+            slower than the baseline."""
+        if not value:
+            self._start = t
+            if self._cmd is not None:
+                self.react.add(ticks_diff(t, self._cmd))
+                self._cmd = None
+            return None
+        if self._start is None:
+            return None
+        ms = ticks_diff(t, self._start)
+        self._start = self._cmd = None
+        base = self.base
+        self.travel.add(ms)
+        if base is None:
+            learn = self._learn
+            learn[0] += 1
+            learn[1] += ms
+            if learn[0] >= self.baseline:
+                self.base = learn[1] // learn[0]
+            self._save()
+        self.alert = None
+        if base is not None and ms > base * self.slow_factor:
+            self.slow += 1
+            self.alert = f"Slow gate: {name} took {ms} ms, baseline {base} ms"
+        return ms
+
+    def summary(self):
+        return {"react": self.react.summary(), "travel": self.travel.summary(),
+                "baseline": self.base, "slow": self.slow}
@@ -0,0 +1,248 @@
+import asyncio
+import os
+import timebase
+import tz
+
+# Absolute: the firmware runs from a slot directory (slots.py), the data
+# stays in the root
+DATAFILENAME = '/data.txt'
+LOGFILENAME = '/debug.log'
+ERRORLOGFILENAME = '/errorlog.txt'
+TMPFILENAME = '/data.tmp'
+
+# Buffers used by rotate(). The line buffer grows by LINE_MAX for a longer
+# line, lines are never cut.
+BLOCK = 256
+LINE_MAX = 160
+
+# Lines for these files are collected in a RAM ring buffer and written out by
+# the writer() task: when FLUSH_AT bytes are waiting, FLUSH_MS after the
+# first waiting line, or at once for errors. Entries are stored as
+# [file index][length hi][length lo][bytes].
+FILES = [DATAFILENAME, ERRORLOGFILENAME]
+RING_SIZE = 2048
+ENTRY_MAX = 512
+FLUSH_AT = 1024
+FLUSH_MS = 5000
+
+_ring = bytearray(RING_SIZE)
+_rmv = memoryview(_ring)
+_head = 0      # next write position
+_tail = 0      # oldest unwritten entry
+_used = 0
+_urgent = False
+_evt = asyncio.Event()
+
+# counters
+appends = 0
+drops = 0
+flushes = 0
+
+
+def stamp():
+    """ Current time in the same 'Y-M-D H:M:S' form the logger uses."""
+    return timebase.stamp()
+
+
+def line_time(line):
+    """ Seconds since epoch (UTC) of a local 'Y-M-D H:M[:S[.mmm]]' line
+        prefix, None if the line doesn't start with one."""
+    try:
+        d, t = line.split(None, 2)[:2]
+        y, mo, dd = d.split(b'-')
+        hms = t.split(b':')
+        s = int(hms[2].split(b'.')[0]) if len(hms) > 2 else 0
+        return tz.mktime((int(y), int(mo), int(dd), int(hms[0]), int(hms[1]), s))
+    except (ValueError, IndexError, OverflowError):
+        return None
+
+
+def _copy_in(data, n):
+    global _head
+    end = _head + n
+    if end <= RING_SIZE:
+        _ring[_head:end] = data
+    else:
+        k = RING_SIZE - _head
+        _ring[_head:] = data[:k]
+        _ring[:n - k] = data[k:]
+    _head = end % RING_SIZE
+
+
+def append(filename, data, urgent=False):
+    """ Queue bytes to be appended to one of FILES. Returns False (and
+        counts a drop) when the buffer is full."""
+    global _used, _urgent, appends, drops
+    n = len(data)
+    if n > ENTRY_MAX:
+        data = data[:ENTRY_MAX]
+        n = ENTRY_MAX
+    if n + 3 > RING_SIZE - _used:
+        drops += 1
+        return False
+    was_empty = not _used
+    _copy_in(bytes((FILES.index(filename), n >> 8, n & 0xff)), 3)
+    _copy_in(data, n)
+    _used += n + 3
+    appends += 1
+    if urgent:
+        _urgent = True
+    if urgent or was_empty or _used >= FLUSH_AT:
+        _evt.set()
+    return True
+
+
+def _entries():
+    # (file index, start, length) of every waiting entry, oldest first
+    pos = _tail
+    left = _used
+    while left:
+        fid = _ring[pos]
+        n = _ring[(pos + 1) % RING_SIZE] << 8 | _ring[(pos + 2) % RING_SIZE]
+        start = (pos + 3) % RING_SIZE
+        yield fid, start, n
+        pos = (start + n) % RING_SIZE
+        left -= n + 3
+
+
+def _chunks(start, n):
+    end = start + n
+    if end <= RING_SIZE:
+        yield _rmv[start:end]
+    else:
+        yield _rmv[start:]
+        yield _rmv[:end - RING_SIZE]
+
+
+def pending(filename):
+    """ Yield the data waiting for 'filename' as memoryviews into the ring.
+        Use them before the next await, the writer may reuse the space."""
+    fid = FILES.index(filename)
+    for f, start, n in _entries():
+        if f == fid:
+            yield from _chunks(start, n)
+
+
+def pending_size(filename):
+    fid = FILES.index(filename)
+    size = 0
+    for f, start, n in _entries():
+        if f == fid:
+            size += n
+    return size
+
+
+def flush():
+    """ Write everything waiting in the ring buffer to its file."""
+    global _tail, _used, _urgent, flushes
+    f = None
+    cur = -1
+    try:
+        for fid, start, n in _entries():
+            if fid != cur:
+                if f is not None:
+                    f.close()
+                f = open(FILES[fid], 'ab')
+                cur = fid
+            for c in _chunks(start, n):
+                f.write(c)
+    finally:
+        if f is not None:
+            f.close()
+    _tail = _head
+    _used = 0
+    _urgent = False
+    flushes += 1
+
+
+async def writer():
+    """ Background task that flushes the ring buffer."""
+    while True:
+        if not _used:
+            _evt.clear()
+            await _evt.wait()
+        if not _urgent and _used < FLUSH_AT:
+            _evt.clear()
+            try:
+                await asyncio.wait_for(_evt.wait(), FLUSH_MS / 1000)
+            except asyncio.TimeoutError:
+                pass
+        try:
+            flush()
+        except OSError as e:
+            print("datalog flush failed:", e)
+            await asyncio.sleep(1)
+
+
+def record(line):
+    """Combined print and append to data file."""
+    print(line)
+    line += '\n'
+    append(DATAFILENAME, line.encode())
+
+
+def error(line):
+    """ Append a time stamped line to the error log, written out at once."""
+    append(ERRORLOGFILENAME, f"{stamp()} {line}\n".encode(), True)
+
+
+def _keep(log, out, n_out, line, n_line):
+    # Add a line to the output block, writing the block out when it is full.
+    if n_out + n_line > BLOCK:
+        log.write(memoryview(out)[:n_out])
+        n_out = 0
+    if n_line > BLOCK:
+        log.write(memoryview(line)[:n_line])
+        return 0
+    out[n_out:n_out + n_line] = memoryview(line)[:n_line]
+    return n_out + n_line
+
+
+def rotate(header):
+    """ Move the previous day's data lines, without the '@' lines, to the
+        debug log and start a new data file with 'header'.
+
+        The data file is streamed through fixed buffers. The new data file is
+        written to a temp file and renamed over the old one only after the
+        log has been written, so a power loss can repeat lines in the log but
+        never lose them."""
+    flush()
+    block = bytearray(BLOCK)
+    mv = memoryview(block)
+    line = bytearray(LINE_MAX)
+    out = bytearray(BLOCK)
+    n_line = 0
+    n_out = 0
+    at = False
+
+    try:
+        src = open(DATAFILENAME, 'rb')
+    except OSError:
+        src = None
+
+    if src is not None:
+        with src, open(LOGFILENAME, 'ab') as log:
+            while True:
+                n = src.readinto(block)
+                if not n:
+                    break
+                for c in mv[:n]:
+                    if n_line == len(line):
+                        line.extend(bytearray(LINE_MAX))
+                    line[n_line] = c
+                    n_line += 1
+                    if c == 64:  # '@'
+                        at = True
+                    elif c == 10:
+                        if not at:
+                            n_out = _keep(log, out, n_out, line, n_line)
+                        n_line = 0
+                        at = False
+            if n_line and not at:
+                n_out = _keep(log, out, n_out, line, n_line)
+            if n_out:
+                log.write(memoryview(out)[:n_out])
+
+    with open(TMPFILENAME, 'w') as file:
+        file.write(header)
+    os.rename(TMPFILENAME, DATAFILENAME)
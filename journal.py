@@ -0,0 +1,84 @@
+import os
+import struct
+import time
+import datalog
+import timebase
+
+# Append-only binary event journal. Every record is 8 bytes:
+# seconds since the device epoch (u32), milliseconds (u16), event code (u8)
+# and a small payload (u8). A new file starts with an EPOCH record whose
+# payload is the epoch year - 1970, so tools/journal_decode.py can convert
+# the times on a PC.
+JOURNALFILENAME = '/journal.bin'
+JOURNAL_MAX = 32768  # bytes, the full file is renamed to journal.bin.1
+FORMAT = '<IHBB'
+SIZE = 8
+
+EPOCH = 0
+POWER_UP = 1
+GATE_OPEN = 2     # payload: open sensor level
+GATE_CLOSED = 3   # payload: closed sensor level
+OBJECT = 4        # payload: object detection level
+COMMAND = 5       # payload: index in COMMANDS
+WIFI = 6          # payload: 1 up, 0 down
+NTP_SYNC = 7      # payload: size of the correction in ms, max 255
+
+NAMES = ("EPOCH", "POWER_UP", "GATE_OPEN", "GATE_CLOSE", "OBJECT", "COMMAND", "WIFI", "NTP_SYNC")
+COMMANDS = ("", "open", "close", "stop")
+SENSORS = {"open": GATE_OPEN, "close": GATE_CLOSED, "objDTC": OBJECT}
+
+# Width of a rendered line, see render()
+LINE = 41
+
+datalog.FILES.append(JOURNALFILENAME)
+
+_rec = bytearray(SIZE)
+
+try:
+    _size = os.stat(JOURNALFILENAME)[6]
+except OSError:
+    _size = 0
+
+
+def _append(code, payload, t, ms):
+    global _size
+    struct.pack_into(FORMAT, _rec, 0, t, ms, code, payload)
+    if datalog.append(JOURNALFILENAME, _rec):
+        _size += SIZE
+
+
+def log(code, payload=0, ms=None):
+    """ Add an event to the journal, at device time ms (default now)."""
+    global _size
+    if ms is None:
+        ms = timebase.now_ms()
+    t = ms // 1000
+    ms %= 1000
+    if _size + SIZE > JOURNAL_MAX:
+        datalog.flush()
+        try:
+            os.rename(JOURNALFILENAME, JOURNALFILENAME + '.1')
+        except OSError:
+            pass
+        _size = 0
+    if not _size:
+        _append(EPOCH, time.gmtime(0)[0] - 1970, t, ms)
+    _append(code, min(max(payload, 0), 255), t, ms)
+
+
+def size():
+    """ Journal size including records still waiting to be written."""
+    return _size
+
+
+def render(buf):
+    """ One fixed width text line for the record in buf."""
+    t, ms, code, payload = struct.unpack(FORMAT, buf)
+    tm = timebase.localtime(t)
+    name = NAMES[code] if code < len(NAMES) else "?%d" % code
+    if code == COMMAND and payload < len(COMMANDS):
+        arg = COMMANDS[payload]
+    else:
+        arg = str(payload)
+    return "%04d-%02d-%02d %02d:%02d:%02d.%03d %-10s %5s\n" % (
+        tm[0], tm[1], tm[2], tm[3], tm[4], tm[5], ms, name, arg)
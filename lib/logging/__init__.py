@@ -9,6 +9,10 @@ INFO     = 20
 DEBUG    = 10
 NOTSET   = 0
 
+# Time source for LogRecord, integer ms since the epoch
+def _time_ms():
+    return int(time.time()) * 1000
+
 _level_dict = {
     CRITICAL: "CRITICAL",
     ERROR: "ERROR",
@@ -193,6 +197,8 @@ class Formatter:
     def __init__(self, fmt=None, datefmt=None, style="%"):
         self.fmt = fmt or "%(message)s"
         self.datefmt = datefmt
+        self._sec = None
+        self._asctime = ""
 
         if style not in ("%", "{"):
             raise ValueError("Style must be one of: %, {")
@@ -234,8 +240,12 @@ class Formatter:
 
     def formatTime(self, record, datefmt=None):
         assert datefmt is None  # datefmt is not supported
-        ct = time.localtime(record.created)
-        return "{0}-{1}-{2} {3}:{4}:{5}".format(*ct)
+        # Records come in bursts, format the time once per second
+        sec = int(record.created)
+        if sec != self._sec:
+            self._sec = sec
+            self._asctime = "{0}-{1}-{2} {3}:{4}:{5}".format(*self.converter(sec))
+        return self._asctime
 
     def formatException(self, exc_info):
         raise NotImplementedError()
@@ -249,9 +259,9 @@ class LogRecord:
         self, name, level, pathname, lineno, msg, args, exc_info, func=None, sinfo=None
     ):
         
-        ct = time.time()
-        self.created = ct
-        self.msecs = (ct - int(ct)) * 1000
+        ms = _time_ms()
+        self.created = ms // 1000
+        self.msecs = ms % 1000
         self.name = name
         self.levelno = level
         self.levelname = _level_dict.get(level, None)
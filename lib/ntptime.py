@@ -8,11 +8,26 @@ try:
     import ustruct as struct
 except:
     import struct
+try:
+    import uasyncio as asyncio
+except:
+    import asyncio
+try:
+    import uerrno as errno
+except:
+    import errno
 
 # The NTP host can be configured at runtime by doing: ntptime.host = 'myhost.org'
 host = "pool.ntp.org"
 # The NTP socket timeout can be configured at runtime by doing: ntptime.timeout = 2
 timeout = 1
+# Servers asked concurrently by sample()/asettime(), "name" or "name:port"
+hosts = ["0.pool.ntp.org", "1.pool.ntp.org", "2.pool.ntp.org"]
+
+# host -> resolved address, getaddrinfo() blocks so it's done once per host
+_addrs = {}
+# host -> (T4, ticks_us at T4) of its last answer
+_rx = {}
 
 
 def time():
@@ -26,8 +41,10 @@ def time():
         msg = s.recv(48)
     finally:
         s.close()
-    val = struct.unpack("!I", msg[40:44])[0]
+    return _epoch(struct.unpack("!I", msg[40:44])[0])
+
 
+def _epoch(val):
     # 2024-01-01 00:00:00 converted to an NTP timestamp
     MIN_NTP_TIMESTAMP = 3913056000
 
@@ -75,4 +92,104 @@ def settime():
     machine.RTC().datetime((tm[0], tm[1], tm[2], tm[6] + 1, tm[3], tm[4], tm[5], 0))
 
 
+# Local time in us the offsets are measured against. A clock discipline
+# layer can replace it by its own time: ntptime.now_us = clock.now_us
+# On the Pico the default only changes once per second (RTC), the round
+# trip is therefore timed with ticks_us from T1 instead.
+def now_us():
+    return utime.time_ns() // 1000
+
+
+def _stamp_us(msg, at):
+    # 64 bit NTP timestamp at msg[at:at+8] to microseconds since our epoch
+    sec, frac = struct.unpack("!II", msg[at:at + 8])
+    return _epoch(sec) * 1000000 + (frac * 1000000 >> 32)
+
+
+def _resolve(name):
+    addr = _addrs.get(name)
+    if addr is None:
+        h, _, port = name.partition(":")
+        addr = socket.getaddrinfo(h, int(port or 123))[0][-1]
+        _addrs[name] = addr
+    return addr
+
+
+async def query(name, timeout_ms=None):
+    """ One NTP exchange with 'name' without blocking the event loop.
+        Returns (offset_us, delay_us): the clock correction and the round
+        trip, from the four timestamps T1 (sent), T2 (server received),
+        T3 (server sent) and T4 (received). None when there is no answer."""
+    if timeout_ms is None:
+        timeout_ms = timeout * 1000
+    try:
+        addr = _resolve(name)
+    except OSError:
+        return None
+    pkt = bytearray(48)
+    pkt[0] = 0x1B
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        s.setblocking(False)
+        start = utime.ticks_ms()
+        t1 = now_us()
+        sent = utime.ticks_us()
+        s.sendto(pkt, addr)
+        while True:
+            try:
+                msg = s.recv(48)
+                rx = utime.ticks_us()
+                t4 = t1 + utime.ticks_diff(rx, sent)
+                break
+            except OSError as e:
+                if e.args[0] != errno.EAGAIN:
+                    raise
+            if utime.ticks_diff(utime.ticks_ms(), start) >= timeout_ms:
+                _addrs.pop(name, None)  # resolve again next time
+                return None
+            await asyncio.sleep_ms(5)
+    except OSError:
+        _addrs.pop(name, None)
+        return None
+    finally:
+        s.close()
+    # A short reply or a kiss-o'-death (stratum 0) is not a sample
+    if len(msg) < 48 or not msg[1]:
+        return None
+    t2 = _stamp_us(msg, 32)
+    t3 = _stamp_us(msg, 40)
+    _rx[name] = (t4, rx)
+    return ((t2 - t1) + (t3 - t4)) // 2, (t4 - t1) - (t3 - t2)
+
+
+async def sample(names=None, timeout_ms=None):
+    """ Ask all 'names' (default: hosts) at once and return the answer with
+        the shortest round trip as (offset_us, delay_us, name), or None."""
+    names = names or hosts
+    res = await asyncio.gather(*[query(n, timeout_ms) for n in names])
+    best = None
+    for name, r in zip(names, res):
+        if r is not None and (best is None or r[1] < best[1]):
+            best = (r[0], r[1], name)
+    return best
+
+
+async def asettime(names=None, timeout_ms=None):
+    """ Async settime(): correct the RTC (UTC) by the best sample's offset.
+        Returns the sample, None if no server answered."""
+    best = await sample(names, timeout_ms)
+    if best is not None:
+        import machine
+
+        # Server time now: T4 corrected by the offset, plus the ticks since.
+        # Unlike now_us() this doesn't depend on where in the RTC second
+        # T1 fell. The RTC has no sub-seconds, set it on the next full second
+        t4, rx = _rx[best[2]]
+        us = t4 + best[0] + utime.ticks_diff(utime.ticks_us(), rx)
+        await asyncio.sleep_ms(1000 - us % 1000000 // 1000)
+        tm = utime.gmtime(us // 1000000 + 1)
+        machine.RTC().datetime((tm[0], tm[1], tm[2], tm[6] + 1, tm[3], tm[4], tm[5], 0))
+    return best
+
+
 __version__ = '0.1.1'
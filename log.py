@@ -1,5 +1,10 @@
 import logging
 from logging.handlers import RotatingFileHandler
+import datalog
+import timebase
+
+# Millisecond record times from the time base, no RTC read per record
+logging._time_ms = timebase.now_ms
 
 # Create a logger object
 logger = logging.getLogger('DEBUG')
@@ -7,7 +12,7 @@ logger.setLevel(logging.DEBUG)  # Set the logger's level to INFO
 
 # Set up a rotating file handler
 file_handler = RotatingFileHandler(
-    'debug.log',          # Log file name
+    datalog.LOGFILENAME,  # Log file name
     maxBytes=30000,    # Maximum size of a log file in bytes before rotation
     backupCount=2       # Number of backup files to keep
 )
@@ -18,7 +23,8 @@ console_handler = logging.StreamHandler()
 
 # Optional: Set a formatter for the log messages
 #formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(message)s')
+formatter = logging.Formatter('%(asctime)s.%(msecs)03d - %(name)s - %(message)s')
+formatter.converter = timebase.localtime
 file_handler.setFormatter(formatter)
 console_handler.setFormatter(formatter)
 
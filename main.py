@@ -1,22 +1,31 @@
+# Stage 0: imports. Only what the gate loop and MQTT need is imported here,
+# OTA and the web server are imported when they are started.
+from time import ticks_ms, ticks_diff
+BOOT_MS = ticks_ms()  # ms since reset when main.py started
+from clock import Clock, MIN_POLL
+from cmdqueue import CmdQueue
+from cycles import Cycles
+import datalog
+from datalog import error, record, rotate, stamp
 import gc
+import journal
 from log import logger
 import machine
-from machine import Pin, RTC
-from mqtt_as import MQTTClient, RP2
+from machine import Pin
+import metrics
+from mqtt_as import MQTTClient
 from mqtt_local import config
-import network
-from ntptime import settime
-import os
-from ota import OTAUpdater
-import sys
+from pulse import PulseGen
+from rssi import Rssi
+from scheduler import Scheduler
+from sensors import SensorBank
+import slots
+import status
 import uasyncio as asyncio
-import time
+import timebase
+import tz
 
 
-if RP2:
-    from sys import implementation
-    
-
 # define motor controller pins
 openSTAT = Pin(16, Pin.IN, Pin.PULL_DOWN)
 closeSTAT = Pin(17, Pin.IN, Pin.PULL_DOWN)
@@ -26,6 +35,23 @@ CMDclose = Pin(20, Pin.OUT)
 CMDstop = Pin(21, Pin.OUT)
 LED = machine.Pin("LED",machine.Pin.OUT)
 
+# Edge triggered, debounced status inputs
+sensors = SensorBank()
+sensors.add(openSTAT, "open")
+sensors.add(closeSTAT, "close")
+sensors.add(objDTC, "objDTC")
+STATUS_TEXT = {
+    "open": "Gate is open",
+    "close": "Gate is closed",
+    "objDTC": "Object detected",
+}
+
+# Relay outputs, open and close are never driven together
+pulses = PulseGen()
+pulses.add(CMDopen, "open", ("close",))
+pulses.add(CMDclose, "close", ("open",))
+pulses.add(CMDstop, "stop", ("open", "close"))
+
 
 #MQTT Details
 CLIENT_ID = config["client_id"]
@@ -35,147 +61,59 @@ PUBLISH_TOPIC1 = str(CLIENT_ID)+"/Command"
 PUBLISH_TOPIC2 = str(CLIENT_ID)+"/Status"
 PUBLISH_TOPIC3 = str(CLIENT_ID)+"/Info"
 
+# Seconds between MQTT being up and the first OTA check, and between checks.
+# The check runs in the background next to the gate loop.
+OTA_DELAY = 60
+OTA_PERIOD = 6 * 3600
+status.state["boot"]["main"] = BOOT_MS
+
+# Periodic and daily jobs
+schedule = Scheduler()
+
+# Commands from MQTT, consumed by commands()
+cmdq = CmdQueue()
+cycles = Cycles()
+signal = Rssi()
+# NTP disciplined time, the RTC runs on UTC. Local time (tz.py) is only
+# applied where times are shown.
+clock = Clock()
+timebase.attach(clock)
+CMD_TEXT = {
+    "open": "Open command received",
+    "close": "Close command received",
+    "stop": "Stop command received",
+}
+
+async def ntp_sync():
+    # Re-planned after every run from the clock's adaptive interval
+    if not clock.wait():
+        await get_ntp()
+    schedule.once(max(clock.wait(), 1), ntp_sync, task=True)
+
+
+async def datapoint():
+    record(f"datapoint @ {stamp()}")
+    gc.collect()
+    # Half hour min/avg/max of the device metrics
+    await client.publish(PUBLISH_TOPIC3 + "/metrics", metrics.dumps(30), qos=0)
+
+
+async def rotate_logs():
+    # Log lines from previous day and start a new data file for today
+    y, mo, d = tz.localtime()[:3]
+    rotate('Date: %d/%d/%d\n' % (mo, d, y))
 
-# Global values
-gc_text = ''
-DATAFILENAME = 'data.txt'
-LOGFILENAME = 'debug.log'
-ERRORLOGFILENAME = 'errorlog.txt'
-
-# Variables
-openCMD = False
-closeCMD = False
-stopCMD = False
-
-# HTML file
-html = """<!DOCTYPE html>
-<html>
-    <head> <title>Gate controller</title> </head>
-    <body> <h1>Entrance gate control</h1>
-        <h3>%s</h3>
-        <h4>%s</h4>
-        <pre>%s</pre>
-    </body>
-</html>
-"""
 
 async def log_handling():
 
-    local_time = time.localtime()
-    global timestamp
-    record("power-up @ (%d, %d, %d, %d, %d, %d, %d, %d)" % local_time)
-
-    try:
-        
-        y = local_time[0]  # curr year
-        mo = local_time[1] # current month
-        d = local_time[2]  # current day
-        h = local_time[3]  # curr hour
-        m = local_time[4]  # curr minute
-        s = local_time[5]  # curr second
-        
-        timestamp = f"{h:02}:{m:02}:{s:02}"
-        # Test WiFi connection twice per minute
-        if s in (15, 45):
-            if not wifi_han(state):
-                record(f"{timestamp} WiFi not connected")
-                
-            elif wifi_han(state):
-                sync_rtc_to_ntp()
-                await asyncio.sleep(1)
-        
-        # Print time on 30 min intervals
-        if s in (1,) and not m % 30:
-            try:
-                record(f"datapoint @ {timestamp}")
-                
-                gc_text = f"free: {str(gc.mem_free())}\n"
-                gc.collect()
-            except Exception as e:
-                with open(ERRORLOGFILENAME, 'a') as file:
-                    file.write(f"error printing: {repr(e)}\n")
-
-        # Once daily (during the wee hours)
-        if h == 2 and m == 10 and s == 1:
-            
-            # Read lines from previous day
-            with open(DATAFILENAME) as f:
-                lines = f.readlines()
-
-            # first line is yesterday's date
-            yesterdate = lines[0].split()[-1].strip()
-
-            # cull all lines containing '@'
-            lines = [line
-                     for line in lines
-                     if '@' not in line]
-            
-            # Log lines from previous day
-            with open(LOGFILENAME, 'a') as f:
-                for line in lines:
-                    f.write(line)
-            
-            # Start a new data file for today
-            with open(DATAFILENAME, 'w') as file:
-                file.write('Date: %d/%d/%d\n' % (mo, d, y))
-
-    except Exception as e:
-        with open(ERRORLOGFILENAME, 'a') as file:
-            file.write(f"main loop error: {str(e)}\n")
-
-
-
-async def serve_client(reader, writer):
-    
-    
-    try:
-        print("Client connected")
-        request_line = await reader.readline()
-        print("Request:", request_line)
-        
-        # We are not interested in HTTP request headers, skip them
-        while await reader.readline() != b"\r\n":
-            pass
-        
-        gc.collect()
-        m = gc.mem_free()
-        version = f"MicroPython Version: {sys.version}"
-
-        if '/log' in request_line.split()[1]:
-            with open(LOGFILENAME) as file:
-                data = file.read()
-            heading = "Debug"
-            print('log demanded')
-        elif '/err' in request_line.split()[1]:
-            with open(ERRORLOGFILENAME) as file:
-                data = file.read()
-            heading = "ERRORS"
-        else:
-            with open(DATAFILENAME) as file:
-                data = file.read()
-            heading = "Append '/log' or '/err' to URL to see log file or error log"
-
-        data += gc_text
-
-        response = html % (heading, version, data)
-        writer.write('HTTP/1.0 200 OK\r\nContent-type: text/html\r\n\r\n')
-        writer.write(response)
-
-        await writer.drain()
-        await writer.wait_closed()
-        dprint("Client disconnected")
-    except Exception as e:
-        with open(ERRORLOGFILENAME, 'a') as file:
-            
-            file.write(f"serve_client error @ {timestamp}: {str(e)}\n")
+    journal.log(journal.POWER_UP)
 
+    schedule.once(MIN_POLL, ntp_sync, task=True)
+    # Print time on 30 min intervals
+    schedule.every(1800, datapoint, align=True)
+    # Once daily (during the wee hours)
+    schedule.daily(2, 10, rotate_logs)
 
-def record(line):
-    """Combined print and append to data file."""
-    print(line)
-    line += '\n'
-    with open(DATAFILENAME, 'a') as file:
-        file.write(line)
 
 def dprint(*args):
         logger.debug(*args)
@@ -185,164 +123,161 @@ def dprint(*args):
 async def heartbeat():
     s = True
     while True:
+        t = ticks_ms()
         await asyncio.sleep_ms(500)
+        metrics.note_lag(ticks_diff(ticks_ms(), t) - 500)
         LED(s)
         s = not s
+        status.refresh()
 
 async def wifi_han(state):
     s = "rssi: {}dB"
     LED(not state)
+    status.state["wifi"] = state
+    journal.log(journal.WIFI, int(state))
+    if not state:
+        status.state["mqtt"] = False
     if state:
         dprint('Wifi is up')
-        dprint(s.format(rssi))
+        dprint(s.format(signal.sample()))
     else:
         dprint('Wifi is down')    
     await asyncio.sleep(1)
 
-async def get_rssi():
-    global rssi
-    s = network.WLAN()
-    ssid = config["ssid"].encode("UTF8")
-    #while True:
-    try:
-        while True:
-            
-            rssi = [x[3] for x in s.scan() if x[0] == ssid][0]
-            
-            break
-        
-    except IndexError:  # ssid not found.
-        rssi = -199
-    await asyncio.sleep(30)
+def got_rssi(v):
+    status.state["rssi"] = v
+    status.state["rssi_range"] = (signal.min, signal.max)
+
+async def scan_wifi():
+    
+    # Diagnostic: full scan for our SSID, stalls the event loop for seconds
+    found = signal.scan(config["ssid"].encode("UTF8"))
+    dprint(f'scan: {found}')
+    await client.publish(PUBLISH_TOPIC3 + "/scan", f"{found}", qos=0)
 
 async def get_ntp():
     
     try:
+        r = await clock.sync()
+        if r is None:
+            error("NTP: no server answered")
+            return
+        offset, delay, server, stepped = r
+        dprint(f'NTP {server}: offset {offset // 1000} ms, delay {delay // 1000} ms, '
+               f'drift {clock.ppm:.1f} ppm, next in {clock.interval} s')
+        if stepped:
+            schedule.time_stepped()
+        status.state["clock"] = clock.state()
+        journal.log(journal.NTP_SYNC, abs(offset) // 1000)
     
-        settime()
-        rtc = machine.RTC()
-        utc_shift = 1
-
-        tm = time.localtime(time.mktime(time.localtime()) + utc_shift*3600)
-        tm = tm[0:3] + (0,) + tm[3:6] + (0,)
-        rtc.datetime(tm)
-    
-    except OSError as e:
-        with open(ERRORLOGFILENAME, 'a') as file:
-            file.write(f"OSError while trying to set time: {str(e)}\n")        
+    except Exception as e:
+        error(f"NTP sync failed: {repr(e)}")
         
-    print("machine time is:",(time.localtime()))
+    print("machine time is:", stamp())
 
 # If you connect with clean_session True, must re-subscribe (MQTT spec 3.1.2.4)
 async def conn_han(client):
     
+    status.state["mqtt"] = True
+    metrics.note_connect()
     await client.subscribe((SUBSCRIBE_TOPIC +"/open"), 1)
     await client.subscribe((SUBSCRIBE_TOPIC +"/close"), 1)
     await client.subscribe((SUBSCRIBE_TOPIC +"/stop"), 1)
+    await client.subscribe((SUBSCRIBE_TOPIC +"/scan"), 0)
 
 # Subscription callback
 def sub_cb(topic, msg, retained):
 
-    global openCMD
-    global closeCMD
-    global stopCMD
-
     dprint(f'Topic: "{topic.decode()}" Message: "{bool(int(msg.decode()))}" Retained: {retained}')
 
+    # A "0" is our own acknowledgement coming back, only "1" is a command
+    if not int(msg.decode()):
+        return
     
     if topic.decode() == SUBSCRIBE_TOPIC +"/open":
-        #print('open: ', bool(int(msg.decode())))
-        openCMD = bool(int(msg.decode()))
+        cmdq.put("open")
               
     elif topic.decode() == SUBSCRIBE_TOPIC +"/stop":
-        #print('stop: ', bool(int(msg.decode())))
-        stopCMD = bool(int(msg.decode()))
+        cmdq.put("stop")
     
     elif topic.decode() == SUBSCRIBE_TOPIC +"/close":
-        #print('close: ', bool(int(msg.decode())))
-        closeCMD = bool(int(msg.decode()))
+        cmdq.put("close")
+    
+    elif topic.decode() == SUBSCRIBE_TOPIC +"/scan":
+        asyncio.create_task(scan_wifi())
         
         
-async def comm(client):
+async def commands():
     
-    global openCMD
-    global closeCMD
-    global stopCMD
+    # Wakes up as soon as sub_cb() queues a command. Pulses run in the
+    # background, acknowledgements are sent by pulse_han()
+    async for cmd in cmdq:
+        dprint(CMD_TEXT[cmd])
+        cycles.command(cmd, pulses.pulse(cmd).start_ms)
+        status.state["last_cmd"] = cmd
+        journal.log(journal.COMMAND, journal.COMMANDS.index(cmd))
+        status.state["last_cmd_time"] = stamp()
+        dprint(f'queue: {len(cmdq)} latency: {cmdq.latency_ms} ms drops: {cmdq.drops}')
+
+
+async def pulse_han(client):
     
-    oldValOpen = False
-    oldValClose = False
-    oldValObjDTC = False
-    
-    
-    while True:
-        asyncio.sleep(1)
-        # If WiFi is down the following will pause for the duration.
-          
-        
-        if openCMD and not closeCMD and not stopCMD:
-            dprint('Open command received')
-            CMDopen(1)
-            asyncio.sleep(1)
-            CMDopen(0)
-            await client.publish((PUBLISH_TOPIC1 +"/open"), f"0", qos=1)
-            openCMD = False
-            asyncio.sleep(1)
-            
-        if  closeCMD and not openCMD and not stopCMD:
-            dprint('Close command received')
-            CMDclose(1)
-            asyncio.sleep(1)
-            CMDclose(0)
-            await client.publish((PUBLISH_TOPIC1 +"/close"), f"0", qos=1)
-            closeCMD = False
-            asyncio.sleep(1)
-            
-        if  stopCMD:
-            dprint('Stop command received')
-            CMDstop(1)
-            asyncio.sleep(1)
-            CMDstop(0)
-            await client.publish((PUBLISH_TOPIC1 +"/stop"), f"0", qos=1)
-            stopCMD = False
-            asyncio.sleep(1)
-            
-        
-        # Send status
-        if openSTAT() and not oldValOpen:
-            dprint("Gate is open")
-            await client.publish((PUBLISH_TOPIC2 +"/open"), f"1", qos=1)
-            oldValOpen = True
-            
-        elif not openSTAT() and oldValOpen:
-            await client.publish((PUBLISH_TOPIC2 +"/open"), f"0", qos=1)
-            oldValOpen = False
+    # Reset the command topic once the relay pulse has ended
+    async for out in pulses:
+        t = timebase.at(out.start_ms)
+        dprint(f'{out.name} pulse {timebase.stamp(t)}.{t % 1000:03d} ({ticks_diff(out.end_ms, out.start_ms)} ms)')
+        await client.publish((PUBLISH_TOPIC1 +"/" + out.name), f"0", qos=1)
+
+
+async def publish_status(client, sensor):
+    if sensor.value:
+        dprint(STATUS_TEXT[sensor.name])
+    status.state[sensor.name] = sensor.value
+    journal.log(journal.SENSORS[sensor.name], sensor.value, timebase.at(sensor.changed_ms))
+    await client.publish((PUBLISH_TOPIC2 +"/" + sensor.name), f"{sensor.value}", qos=1)
+    sensor.published()
+
+
+def stage(name):
+    # Boot stage reached, in ms since reset
+    status.state["boot"][name] = ticks_ms()
+
+
+async def comm(client):
     
+    # Report the inputs that are already active, after that the loop only
+    # wakes up on a debounced transition.
+    for sensor in sensors.sensors:
+        status.state[sensor.name] = sensor.value
+        if sensor.value:
+            await publish_status(client, sensor)
+    if "status" not in status.state["boot"]:
+        stage("status")
+        msg = f'Boot: status published {status.state["boot"]["status"]} ms after reset'
+        dprint(msg)
+        await client.publish(PUBLISH_TOPIC3, msg, qos=1)
+        # MQTT is up and the gate loop runs: keep this firmware slot
+        failed = slots.confirm()
+        status.state["slot"] = slots.state["active"] or "/"
+        if failed:
+            error(f"OTA: {failed} did not confirm, rolled back")
+            await client.publish(PUBLISH_TOPIC3, f'Rolled back from {failed}', qos=1)
     
-        if closeSTAT() and not oldValClose:
-            dprint("Gate is closed")
-            await client.publish((PUBLISH_TOPIC2 +"/close"), f"1", qos=1)
-            oldValClose = True
-            
-        elif not closeSTAT() and oldValClose:
-            await client.publish((PUBLISH_TOPIC2 +"/close"), f"0", qos=1)
-            oldValClose = False
-
-
-
-        if objDTC() and not oldValObjDTC:
-            dprint("Object detected")
-            await client.publish((PUBLISH_TOPIC2 +"/objDTC"), f"1", qos=1)
-            oldValObjDTC = True
-            
-        elif not objDTC() and oldValObjDTC:
-            await client.publish((PUBLISH_TOPIC2 +"/objDTC"), f"0", qos=1)
-            oldValObjDTC = False
-
-        await asyncio.sleep(0.5)
+    async for sensor in sensors:
+        await publish_status(client, sensor)
+        if sensor.name in ("open", "close"):
+            ms = cycles.sensor(sensor.name, sensor.value, sensor.changed_ms)
+            if ms is not None:
+                metrics.note_cycle(ms)
+                status.state["cycles"] = cycles.summary()
+                if cycles.alert:
+                    error(cycles.alert)
+                    await client.publish(PUBLISH_TOPIC3, cycles.alert, qos=1)
         
 async def OTA():
     
     # Check for OTA updates
+    from ota import OTAUpdater
     repo_name = "GatePicoOTA"
     branch = "refs/heads/main"
     firmware_url = f"https://github.com/MartiMan79/{repo_name}/{branch}/"
@@ -350,28 +285,70 @@ async def OTA():
                              "main.py",
                              "ota.py",
                              "log.py",
+                             "datalog.py",
+                             "journal.py",
+                             "metrics.py",
+                             "web.py",
+                             "clock.py",
+                             "cmdqueue.py",
+                             "cycles.py",
+                             "pulse.py",
+                             "rssi.py",
+                             "scheduler.py",
+                             "sensors.py",
+                             "status.py",
+                             "timebase.py",
+                             "tz.py",
                              "lib/ntptime.py",
                              "lib/logging/handlers.py",
                              "lib/logging/__init__.py",
+                             "lib/mqtt_as/__init__.py",
+                             manifest=True,
                              )
-    ota_updater.download_and_install_update_if_available()     
+    # An update ends with a reset, write out the buffered lines first
+    datalog.flush()
+    try:
+        await ota_updater.download_and_install_update_if_available()
+    except Exception as e:
+        error(f"OTA check failed: {repr(e)}")
 
-async def main(client):
+async def deferred(client):
+    
+    # Stage 3: everything the gate doesn't need to run
+    import web
+    asyncio.create_task(asyncio.start_server(web.serve_client, "0.0.0.0", 80))
+    stage("web")
+    # Give a boot loop a chance to be seen before hitting GitHub. Planned
+    # before anything else here can fail.
+    schedule.every(OTA_PERIOD, OTA, task=True)
+    schedule.once(OTA_DELAY, OTA, task=True)
+    await get_ntp()
+    stage("ntp")
+    dprint(f'Boot stages (ms): {status.state["boot"]}')
 
-  
-    try:
-        await client.connect()
-        await client.publish(PUBLISH_TOPIC3, f'Connected', qos=1)
 
+async def main(client):
 
-       
-    except OSError:
-        dprint('Connection failed.')
-        return
-    
+    # Stage 1: gate I/O and the local state, no network needed
+    for sensor in sensors.sensors:
+        status.state[sensor.name] = sensor.value
+    asyncio.create_task(commands())
+    stage("io")
     
-    await get_ntp()
-    await OTA()
+    # Stage 2: MQTT, retried until it connects instead of giving up
+    delay = 2
+    while True:
+        try:
+            await client.connect()
+            break
+        except OSError:
+            dprint('Connection failed.')
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60)
+    stage("mqtt")
+    await client.publish(PUBLISH_TOPIC3, f'Connected', qos=1)
+    asyncio.create_task(pulse_han(client))
+    asyncio.create_task(deferred(client))
     dprint("Startup ready")
 
     while True:
@@ -391,14 +368,17 @@ config['keepalive'] = 120
 MQTTClient.DEBUG = False  # Optional
 client = MQTTClient(config)
 
+asyncio.create_task(datalog.writer())
 asyncio.create_task(heartbeat())
-asyncio.create_task(get_rssi())
+asyncio.create_task(metrics.sampler(lambda: signal.value))
+asyncio.create_task(signal.run(on_sample=got_rssi))
+asyncio.create_task(schedule.run())
 asyncio.create_task(log_handling())
-asyncio.create_task(asyncio.start_server(serve_client, "0.0.0.0", 80))
 
 try:
     asyncio.run(main(client))
     
 finally:
+    datalog.flush()
     client.close()  # Prevent LmacRxBlk:1 errors
     asyncio.new_event_loop() 
@@ -0,0 +1,121 @@
+import asyncio
+import gc
+import json
+from array import array
+from time import ticks_ms, ticks_diff
+
+# One sample per series every PERIOD seconds, SIZE samples kept (4 hours).
+# All buffers are allocated here at import, sampling itself doesn't allocate.
+PERIOD = 60
+SIZE = 240
+# Stored for a period without a value (no RSSI reading, no gate movement),
+# left out of the buckets
+MISSING = -0x80000000
+
+
+class Series:
+    """ Fixed size ring of int samples."""
+
+    def __init__(self, name, size=SIZE):
+        self.name = name
+        self.data = array('i', [0] * size)
+        self.size = size
+        self.n = 0   # samples stored
+        self.i = 0   # next write position
+
+    def add(self, v):
+        self.data[self.i] = v
+        self.i = (self.i + 1) % self.size
+        if self.n < self.size:
+            self.n += 1
+
+    def last(self):
+        v = self.data[(self.i - 1) % self.size] if self.n else MISSING
+        return None if v == MISSING else v
+
+    def buckets(self, per=1):
+        """ [min, avg, max] for every 'per' (1..size) samples, oldest first.
+            None for a bucket without any values."""
+        per = max(1, min(per, self.size))
+        out = []
+        start = (self.i - self.n) % self.size
+        k = 0
+        while k < self.n:
+            m = min(per, self.n - k)
+            lo = hi = None
+            total = count = 0
+            for j in range(m):
+                v = self.data[(start + k + j) % self.size]
+                if v == MISSING:
+                    continue
+                total += v
+                count += 1
+                if lo is None or v < lo:
+                    lo = v
+                if hi is None or v > hi:
+                    hi = v
+            out.append([lo, total // count, hi] if count else None)
+            k += m
+        return out
+
+
+free = Series("free")          # free heap, bytes
+rssi = Series("rssi")          # WiFi signal, dBm
+lag = Series("lag")            # worst event loop lag in the period, ms
+reconnects = Series("reconnects")  # MQTT (re)connections in the period
+cycle = Series("cycle")        # longest gate travel time in the period, ms
+SERIES = (free, rssi, lag, reconnects, cycle)
+
+_max_lag = 0
+_connects = 0
+_max_cycle = MISSING
+
+
+def note_lag(ms):
+    """ Report how late a periodic task woke up."""
+    global _max_lag
+    if ms > _max_lag:
+        _max_lag = ms
+
+
+def note_connect():
+    global _connects
+    _connects += 1
+
+
+def note_cycle(ms):
+    """ Report the travel time of a completed gate movement."""
+    global _max_cycle
+    if ms > _max_cycle:
+        _max_cycle = ms
+
+
+def sample(signal):
+    """ Close the period. signal is the RSSI, None when there is none."""
+    global _max_lag, _connects, _max_cycle
+    free.add(gc.mem_free())
+    rssi.add(MISSING if signal is None else signal)
+    lag.add(_max_lag)
+    reconnects.add(_connects)
+    cycle.add(_max_cycle)
+    _max_lag = 0
+    _connects = 0
+    _max_cycle = MISSING
+
+
+def dumps(per=1):
+    """ All series as JSON, downsampled to [min, avg, max] per 'per' samples."""
+    return json.dumps({
+        "period": PERIOD * per,
+        "series": {s.name: s.buckets(per) for s in SERIES},
+    })
+
+
+async def sampler(get_rssi):
+    """ Background task taking one sample of every series per PERIOD.
+        get_rssi() returns the current signal level."""
+    while True:
+        t = ticks_ms()
+        await asyncio.sleep(PERIOD)
+        note_lag(ticks_diff(ticks_ms(), t) - PERIOD * 1000)
+        sample(get_rssi())
@@ -1,14 +1,101 @@
-import urequests
+import asyncio
+import binascii
+import gc
+import hashlib
 import os
 import json
 import machine
-from time import sleep
+import slots
+from time import ticks_ms, ticks_diff
+
+# Downloads are copied from the socket to the staging file through this
+# buffer, RAM use doesn't depend on the file size.
+CHUNK = 1024
+_buf = bytearray(CHUNK)
+_mv = memoryview(_buf)
+
+# Lists every file of a release: {"version": N, "files": [{"path": ...,
+# "size": bytes, "sha256": hex}, ...]}, written by tools/make_manifest.py
+MANIFEST = 'manifest.json'
+
+# The updater runs next to the gate loop: after SLICE_MS of flash or hash
+# work it sleeps PAUSE_MS so other tasks get their turn. Network reads time
+# out after TIMEOUT seconds.
+SLICE_MS = 20
+PAUSE_MS = 10
+TIMEOUT = 10
+
+
+class Response:
+    """ Status, headers and the body stream of an HTTP GET."""
+
+    def __init__(self, reader, writer):
+        self.raw = reader
+        self._writer = writer
+        self.status_code = 0
+        self.headers = {}
+
+    async def read(self):
+        """ The whole (small) body."""
+        body = b''
+        while True:
+            data = await asyncio.wait_for(self.raw.read(CHUNK), TIMEOUT)
+            if not data:
+                return body
+            body += data
+
+    def close(self):
+        self._writer.close()
+
+
+async def get(url):
+    """ Non-blocking HTTP/1.0 GET on asyncio streams (https via ssl)."""
+    proto, _, host, path = url.split('/', 3)
+    port = 443 if proto == 'https:' else 80
+    if ':' in host:
+        host, port = host.split(':')
+        port = int(port)
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection(host, port, ssl=True if port == 443 else None), TIMEOUT)
+    response = Response(reader, writer)
+    try:
+        writer.write(f'GET /{path} HTTP/1.0\r\nHost: {host}\r\n'
+                     f'User-Agent: GatePicoOTA\r\n\r\n'.encode())
+        await writer.drain()
+        line = await asyncio.wait_for(reader.readline(), TIMEOUT)
+        response.status_code = int(line.split(None, 2)[1])
+        while True:
+            line = await asyncio.wait_for(reader.readline(), TIMEOUT)
+            if line in (b'\r\n', b'\n', b''):
+                break
+            key, _, value = line.decode().partition(':')
+            response.headers[key.strip()] = value.strip()
+    except Exception:
+        response.close()
+        raise
+    return response
+
+
+def file_size(path):
+    try:
+        return os.stat(path)[6]
+    except OSError:
+        return None
 
 class OTAUpdater:
     """ This class handles OTA updates. It checks for updates (using version number),
-        then downloads and installs multiple filenames, separated by commas."""
+        then downloads and installs multiple filenames, separated by commas.
+
+        With manifest=True the release's manifest.json is fetched instead and
+        only the files whose size or SHA-256 differ from the local copy are
+        downloaded; filenames can then be left out.
 
-    def __init__(self, repo_url, *filenames):
+        Updates are staged in the inactive slot (see slots.py): changed files
+        are downloaded into it, unchanged ones copied from the running slot.
+        The update is committed by switching the slot pointer and resetting,
+        a slot that doesn't confirm after the reset is rolled back."""
+
+    def __init__(self, repo_url, *filenames, manifest=False):
         
         if "www.github.com" in repo_url :
             print(f"Updating {repo_url} to raw.githubusercontent")
@@ -16,12 +103,20 @@ class OTAUpdater:
         elif "github.com" in repo_url:
             print(f"Updating {repo_url} to raw.githubusercontent'")
             self.repo_url = repo_url.replace("github","raw.githubusercontent")            
+        else:
+            self.repo_url = repo_url
         self.version_url = self.repo_url + 'version.json'
         print(f"version url is: {self.version_url}")
         self.filename_list = [filename for filename in filenames]
+        self.manifest = manifest
+        self.bytes_fetched = 0
+        self._slice = ticks_ms()
+        self.slot = slots.state["active"]  # running firmware
+        self.stage = slots.inactive()       # where the update goes
+        self.dirs = set()                   # directories known to exist
 
         # get the current version (stored in version.json)
-        if 'version.json' in os.listdir():    
+        if file_size('version.json') is not None:
             with open('version.json') as f:
                 self.current_version = int(json.load(f)['version'])
             print(f"Current device firmware version is '{self.current_version}'")
@@ -32,96 +127,165 @@ class OTAUpdater:
             with open('version.json', 'w') as f:
                 json.dump({'version': self.current_version}, f)
 
-    def fetch_new_code(self, filename):
-        """ Fetch the code from the repo, returns False if not found."""
+    def makedirs(self, path):
+        """ Create the missing parent directories of the absolute path, at
+            any depth. Directories made or seen before aren't checked again."""
+        d = path[:path.rfind('/')]
+        if not d or d in self.dirs:
+            return
+        self.makedirs(d)
+        try:
+            os.mkdir(d)
+        except OSError:
+            pass  # exists
+        self.dirs.add(d)
+
+    async def give_way(self):
+        """ Pause once SLICE_MS have passed since the last pause."""
+        if ticks_diff(ticks_ms(), self._slice) >= SLICE_MS:
+            await asyncio.sleep_ms(PAUSE_MS)
+            self._slice = ticks_ms()
+
+    async def file_sha256(self, path):
+        """ Hex SHA-256 of a local file, hashed CHUNK bytes at a time. None if
+            the file doesn't exist."""
+        h = hashlib.sha256()
+        try:
+            with open(path, 'rb') as f:
+                while True:
+                    k = f.readinto(_mv)
+                    if not k:
+                        break
+                    h.update(_mv[:k])
+                    await self.give_way()
+        except OSError:
+            return None
+        return binascii.hexlify(h.digest()).decode()
+
+    async def fetch_new_code(self, filename, sha256=None):
+        """ Fetch the code from the repo, returns False if not found (or when
+            it doesn't match the expected sha256)."""
     
-        # Fetch the latest code from the repo.
+        # Fetch the latest code from the repo into the staging slot.
         self.firmware_url = self.repo_url + filename
-        count = 0
-        
-        for char in filename:
-            
-            if char == "/":
-                count += 1
-            #return count
+        path = slots.path(self.stage, filename)
+        self.makedirs(path)
+        response = await get(self.firmware_url)
+        try:
+            if response.status_code == 200:
+                print(f'Fetched file {filename}, status: {response.status_code}')
         
-        if count == 1:
-            prefix1 = filename.split("/")[0]
-
-            filename = filename.split("/")[1]
-            if not prefix1 in os.listdir():
-                print('Directory not available')
-                print(prefix1)
-                os.mkdir(prefix1)
-            #else: print('Directory available')
-                
-            os.chdir(prefix1)
-            print(filename)
-            
-        if count == 2:
-            prefix1 = filename.split("/")[0]
-            prefix2 = filename.split("/")[1]
-
-            filename = filename.split("/")[2]
-            os.chdir(prefix1)
-            if not prefix2 in os.listdir():
-                print('Directory not available')
-                print(prefix2)
-                os.mkdir(prefix2)
-            #else: print('Directory available')
-                
-            os.chdir(prefix2)
-            print(filename)
-
-        if count == 3:
-            prefix1 = filename.split("/")[0]
-            prefix2 = filename.split("/")[1]
-            prefix3 = filename.split("/")[2]
-            os.chdir(prefix1)
-            os.chdir(prefix2)
+                # Stream the body to file
+                ok = await self.stream_to_file(response, path, sha256)
+                if ok:
+                    print(f'Saved as {path}')
+                return ok
             
-            filename = filename.split("/")[3]
-            if not prefix3 in os.listdir():
-                #print('Directory not available')
-                print(prefix3)
-                os.mkdir(prefix3)
-            #else: print('Directory available')
-                
-            os.chdir(prefix3)
-            print(filename)
+            elif response.status_code == 404:
+                print(f'Firmware not found - {self.firmware_url}.')
+            return False
+        finally:
+            response.close()
 
-            
-        
-            
-        response = urequests.get(self.firmware_url)
-        if response.status_code == 200:
-            print(f'Fetched file {filename}, status: {response.status_code}')
-    
-            # Save the fetched code to file (with prepended '_')
-            new_code = response.text
-            with open(f'_{filename}', 'w') as f:
-                f.write(new_code)
-            print(f'Saved as _{filename}')
-            #print(os.getcwd())
-            #go back to root
-            if not os.getcwd() == "/":
-                
-                os.chdir("/")
-            #print('Current directory: ', os.getcwd)    
-                
-            return True
-        
-        elif response.status_code == 404:
-            print(f'Firmware not found - {self.firmware_url}.')
+    async def stream_to_file(self, response, path, sha256=None):
+        """ Copy the response body from the socket to path, CHUNK bytes at a
+            time. Returns False (and removes the file) when the body is
+            shorter or longer than Content-Length or its hash isn't sha256."""
+        length = None
+        for key, value in response.headers.items():
+            if key.lower() == 'content-length':
+                length = int(value)
+        gc.collect()
+        free = low = gc.mem_free()
+        start = ticks_ms()
+        n = 0
+        h = hashlib.sha256() if sha256 else None
+        raw = response.raw
+        with open(path, 'wb') as f:
+            while True:
+                k = await asyncio.wait_for(raw.readinto(_mv), TIMEOUT)
+                if not k:
+                    break
+                f.write(_mv[:k])
+                if h:
+                    h.update(_mv[:k])
+                n += k
+                await self.give_way()
+                m = gc.mem_free()
+                if m < low:
+                    low = m
+        ms = ticks_diff(ticks_ms(), start)
+        self.bytes_fetched += n
+        print(f'{path}: {n} bytes in {ms} ms, {n * 1000 // max(ms, 1)} B/s, '
+              f'peak memory {free - low} bytes')
+        if length is not None and n != length:
+            print(f'{path}: expected {length} bytes, got {n}')
+            os.remove(path)
             return False
+        if h and binascii.hexlify(h.digest()).decode() != sha256:
+            print(f'{path}: SHA-256 mismatch')
+            os.remove(path)
+            return False
+        return True
+
+    async def changed_files(self):
+        """ Fetch the manifest into the staging slot and return the files
+            that differ from the running ones as [(path, sha256)], and the
+            paths that are the same. The size is compared first, a file is
+            only hashed when it has the right size. None without a manifest
+            or with one for another version."""
+        manifest = slots.path(self.stage, MANIFEST)
+        response = await get(self.repo_url + MANIFEST)
+        try:
+            if response.status_code != 200:
+                print(f'Manifest not found - {self.repo_url + MANIFEST}.')
+                return None
+            ok = await self.stream_to_file(response, manifest)
+        finally:
+            response.close()
+        if not ok:
+            return None
+        with open(manifest) as f:
+            manifest = json.load(f)
+        # A manifest that wasn't regenerated for this release would make
+        # every file look unchanged
+        if manifest.get('version') != self.latest_version:
+            print(f"Manifest is for version {manifest.get('version')}, not {self.latest_version}")
+            return None
+        files = manifest['files']
+        changed = []
+        same = []
+        for entry in files:
+            path = entry['path']
+            local = slots.path(self.slot, path)
+            if file_size(local) != entry['size'] or await self.file_sha256(local) != entry['sha256']:
+                changed.append((path, entry['sha256']))
+            else:
+                same.append(path)
+        print(f'{len(changed)} of {len(files)} files changed')
+        return changed, same
 
-    def check_for_updates(self):
+    async def copy_file(self, path):
+        """ Copy an unchanged file from the running slot to the staging slot."""
+        dst = slots.path(self.stage, path)
+        self.makedirs(dst)
+        with open(slots.path(self.slot, path), 'rb') as src, open(dst, 'wb') as f:
+            while True:
+                k = src.readinto(_mv)
+                if not k:
+                    break
+                f.write(_mv[:k])
+                await self.give_way()
+
+    async def check_for_updates(self):
         """ Check if updates are available. (Note: GitHub caches values for 5 min.)"""
         
         print(f'Checking for latest version... on {self.version_url}')
-        response = urequests.get(self.version_url)
-        
-        data = json.loads(response.text)
+        response = await get(self.version_url)
+        try:
+            data = json.loads(await response.read())
+        finally:
+            response.close()
         
         print(f"data is: {data}, url is: {self.version_url}")
         print(f"data version is: {data['version']}")
@@ -137,55 +301,43 @@ class OTAUpdater:
         print(f'Newer version available: {newer_version_available}')    
         return newer_version_available
     
-    def download_and_install_update_if_available(self):
+    async def download_and_install_update_if_available(self):
         """ Check for updates, download and install them."""
-        if self.check_for_updates():
+        if await self.check_for_updates():
+            if self.latest_version <= slots.state["bad_version"]:
+                print(f'Version {self.latest_version} was rolled back before, not installed')
+                return
 
-            # Fetch new code
-            for filename in self.filename_list:
-                self.fetch_new_code(filename)
-            
-            # Overwrite current code with new
-            for filename in self.filename_list:
-                count = 0
-                #print('Filename :', filename)
-                for char in filename:
-                    if char == "/":
-                        count += 1
-            
-                if count == 1:
-                    prefix1 = filename.split("/")[0]
-                    os.chdir(prefix1)
-                    filename = filename.split("/")[1]
-                    
-                if count == 2:
-                    prefix2 = filename.split("/")[1]
-                    os.chdir(prefix1)
-                    os.chdir(prefix2)
-                    filename = filename.split("/")[2]
-                    
-                if count == 3:
-                    prefix3 = filename.split("/")[2]
-                    os.chdir(prefix1)
-                    os.chdir(prefix2)
-                    os.chdir(prefix3)
-                    filename = filename.split("/")[3]
-                    
-                newfile = f"_{filename}"
-                os.rename(newfile, filename)
-                print(f'Renamed _{filename} to {filename}, overwriting existing file')
-                if not os.getcwd() == "/":
-                
-                    os.chdir("/")
-                
-            # save the current version
-            with open('version.json', 'w') as f:
+            # Start from an empty staging slot
+            slots.wipe(self.stage)
+            os.mkdir(self.stage)
+            self.dirs = {self.stage}
+
+            # Without a manifest in the release every file is fetched
+            files = await self.changed_files() if self.manifest else None
+            if files is None:
+                files = [(filename, None) for filename in self.filename_list], []
+            changed, same = files
+
+            # Fetch new code, a missing or truncated file cancels the update
+            for filename, sha256 in changed:
+                if not await self.fetch_new_code(filename, sha256):
+                    print(f'Update cancelled, {filename} could not be fetched')
+                    return
+            print(f'Fetched {self.bytes_fetched} bytes')
+            for filename in same:
+                await self.copy_file(filename)
+
+            # save the new version with the new code
+            with open(slots.path(self.stage, 'version.json'), 'w') as f:
                 json.dump({'version': self.latest_version}, f)
-            print('Update version from {self.current_version} to {self.latest_version}')
+            # A single rename switches to the new slot on the next boot
+            slots.commit(self.stage)
+            print(f'Update version from {self.current_version} to {self.latest_version} in {self.stage}')
 
             # Restart the device to run the new code.
             print('Restarting device...')
-            sleep(0.3)
+            await asyncio.sleep_ms(300)
             machine.reset() 
         else:
             print('No new updates available.')
@@ -0,0 +1,86 @@
+import asyncio
+from time import ticks_ms, ticks_diff, ticks_add
+
+# Default relay pulse width
+PULSE_MS = 1000
+
+
+class Output:
+    """ One relay output driven by PulseGen."""
+
+    def __init__(self, pin, name, interlock):
+        self.pin = pin
+        self.name = name
+        self.interlock = interlock  # outputs forced low when this one fires
+        self.task = None
+        self.deadline = 0
+        self.start_ms = 0
+        self.end_ms = 0
+        self.pulses = 0
+        pin(0)
+
+    def active(self):
+        return self.task is not None
+
+
+class PulseGen:
+    """ Owns the command relays and runs "pulse pin X for N ms" jobs on the
+        event loop. pulse() returns at once; finished pulses can be collected
+        with 'async for output in pulsegen'."""
+
+    def __init__(self):
+        self.outputs = {}
+        self._done = []
+        self._evt = asyncio.Event()
+
+    def add(self, pin, name, interlock=()):
+        self.outputs[name] = Output(pin, name, interlock)
+
+    def pulse(self, name, ms=PULSE_MS):
+        """ Start (or retrigger) a pulse. Interlocked outputs are released
+            before this one goes high."""
+        out = self.outputs[name]
+        for other in out.interlock:
+            self.cancel(other)
+        out.deadline = ticks_add(ticks_ms(), ms)
+        if out.task is None:
+            out.pin(1)
+            out.start_ms = ticks_ms()
+            out.task = asyncio.create_task(self._hold(out))
+        return out
+
+    def cancel(self, name):
+        """ End a running pulse early."""
+        out = self.outputs[name]
+        task = out.task
+        if task is not None:
+            self._release(out)
+            task.cancel()
+
+    def _release(self, out):
+        out.pin(0)
+        out.end_ms = ticks_ms()
+        out.task = None
+        out.pulses += 1
+        self._done.append(out)
+        self._evt.set()
+
+    async def _hold(self, out):
+        try:
+            while True:
+                d = ticks_diff(out.deadline, ticks_ms())
+                if d <= 0:
+                    break
+                await asyncio.sleep_ms(d)
+        except asyncio.CancelledError:
+            return
+        self._release(out)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self._done:
+            self._evt.clear()
+            await self._evt.wait()
+        return self._done.pop(0)
@@ -0,0 +1,59 @@
+import asyncio
+import network
+
+# Weight of a new sample in the moving average
+ALPHA = 0.25
+PERIOD = 10
+
+
+class Rssi:
+    """ Signal level of the access point we are associated with, read with
+        WLAN.status('rssi') which is a register read, not a radio scan.
+
+        value is the smoothed level (EWMA) in dBm, None until the first
+        sample; min/max track the raw samples since start-up."""
+
+    def __init__(self, wlan=None, alpha=ALPHA):
+        self.wlan = wlan or network.WLAN(network.STA_IF)
+        self.alpha = alpha
+        self.value = None
+        self._avg = 0.0
+        self.raw = None
+        self.min = None
+        self.max = None
+        self.samples = 0
+        self.errors = 0
+
+    def sample(self):
+        if not self.wlan.isconnected():
+            return self.value
+        try:
+            v = self.wlan.status('rssi')
+        except (OSError, ValueError):
+            self.errors += 1
+            return self.value
+        self.raw = v
+        self.samples += 1
+        if self.value is None:
+            self._avg = v
+            self.min = self.max = v
+        else:
+            self._avg += self.alpha * (v - self._avg)
+            if v < self.min:
+                self.min = v
+            elif v > self.max:
+                self.max = v
+        self.value = round(self._avg)
+        return self.value
+
+    def scan(self, ssid):
+        """ Diagnostic only: a full scan blocks the radio and the event loop
+            for seconds. Returns [(bssid hex, channel, rssi)] for 'ssid'."""
+        return [(x[1].hex(), x[2], x[3]) for x in self.wlan.scan() if x[0] == ssid]
+
+    async def run(self, period=PERIOD, on_sample=None):
+        while True:
+            v = self.sample()
+            if on_sample is not None:
+                on_sample(v)
+            await asyncio.sleep(period)
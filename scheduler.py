@@ -0,0 +1,150 @@
+import asyncio
+import time
+from time import ticks_ms, ticks_diff, ticks_add
+from datalog import error
+import tz
+
+DAY = 86400
+# A wall clock job that an RTC step jumped over is still run if it is at most
+# this many seconds late, older ones are skipped (e.g. the first NTP sync
+# after a power-up with the RTC at 2021-01-01).
+MAX_CATCHUP = 3600
+
+
+class Job:
+
+    def __init__(self, coro, period=0, at=None, align=False, task=False):
+        self.coro = coro      # async function, called without arguments
+        self.task = task      # run as its own task, not inline in run()
+        self.running = False
+        self.period = period  # seconds between runs, 0 for a one-shot job
+        self.at = at          # (hour, minute) for daily jobs
+        self.align = align    # periodic job aligned to the wall clock
+        self.due = 0          # ticks_ms of the next run
+        self.when = 0         # wall clock time of the next run (wall jobs only)
+        self.runs = 0
+
+    def wall(self):
+        return self.at is not None or self.align
+
+
+class Scheduler:
+    """ Runs async jobs 'every N seconds', 'daily at HH:MM' and once after a
+        delay. The run() task sleeps until the next job is due, so it wakes
+        up only when there is something to do. Jobs run one after the other
+        inside run(); long jobs (network, OTA) are added with task=True and
+        started as a task of their own so they don't hold up the others. A
+        task job that is still running when it is due again is skipped.
+
+        Periodic jobs are kept on ticks_ms, each run is planned from the
+        previous due time so they don't drift. Daily and aligned jobs follow
+        the wall clock; call time_stepped() after the RTC has been set."""
+
+    def __init__(self):
+        self._jobs = []  # sorted by due time
+        self._evt = asyncio.Event()
+        self.wakeups = 0
+
+    def every(self, seconds, coro, align=False, task=False):
+        """ Run every 'seconds'. With align the runs fall on wall clock
+            multiples of the period, e.g. 1800 runs on the hour and half hour."""
+        job = Job(coro, seconds, align=align, task=task)
+        if align:
+            self._plan_wall(job, time.time())
+        else:
+            job.due = ticks_add(ticks_ms(), seconds * 1000)
+        return self._add(job)
+
+    def daily(self, hour, minute, coro, task=False):
+        job = Job(coro, DAY, at=(hour, minute), task=task)
+        self._plan_wall(job, time.time())
+        return self._add(job)
+
+    def once(self, seconds, coro, task=False):
+        job = Job(coro, task=task)
+        job.due = ticks_add(ticks_ms(), int(seconds * 1000))
+        return self._add(job)
+
+    def cancel(self, job):
+        if job in self._jobs:
+            self._jobs.remove(job)
+
+    def time_stepped(self):
+        """ Re-plan the wall clock jobs after the RTC was set. A job that the
+            step jumped over runs now, unless it is more than MAX_CATCHUP late."""
+        now = time.time()
+        for job in [j for j in self._jobs if j.wall()]:
+            self._jobs.remove(job)
+            late = now - job.when
+            if 0 <= late <= MAX_CATCHUP:
+                job.due = ticks_ms()
+            else:
+                self._plan_wall(job, now)
+            self._add(job)
+
+    def _plan_wall(self, job, now):
+        # Next wall clock occurrence after 'now', converted to ticks.
+        if job.at is not None:
+            t = tz.localtime(now)
+            delta = job.at[0] * 3600 + job.at[1] * 60 - (t[3] * 3600 + t[4] * 60 + t[5])
+            if delta <= 0:
+                delta += DAY
+        else:
+            delta = job.period - now % job.period
+        job.when = now + delta
+        job.due = ticks_add(ticks_ms(), int(delta * 1000))
+
+    def _add(self, job):
+        jobs = self._jobs
+        i = 0
+        while i < len(jobs) and ticks_diff(jobs[i].due, job.due) <= 0:
+            i += 1
+        jobs.insert(i, job)
+        if not i:
+            self._evt.set()
+        return job
+
+    def _next(self, job):
+        # Plan the run after the one that is starting now.
+        if job.wall():
+            self._plan_wall(job, max(time.time(), job.when))
+        else:
+            job.due = ticks_add(job.due, job.period * 1000)
+            # Skip runs that were missed instead of running them back to back
+            late = ticks_diff(ticks_ms(), job.due)
+            if late > 0:
+                job.due = ticks_add(job.due, (late // (job.period * 1000) + 1) * job.period * 1000)
+        self._add(job)
+
+    async def run(self):
+        while True:
+            self._evt.clear()
+            if not self._jobs:
+                await self._evt.wait()
+                continue
+            job = self._jobs[0]
+            d = ticks_diff(job.due, ticks_ms())
+            if d > 0:
+                try:
+                    await asyncio.wait_for(self._evt.wait(), d / 1000)
+                except asyncio.TimeoutError:
+                    pass
+                self.wakeups += 1
+                continue
+            self._jobs.pop(0)
+            if job.period:
+                self._next(job)
+            if not job.task:
+                await self._call(job)
+            elif not job.running:
+                asyncio.create_task(self._call(job))
+
+    async def _call(self, job):
+        job.runs += 1
+        job.running = True
+        try:
+            await job.coro()
+        except Exception as e:
+            error(f"scheduler job error: {repr(e)}")
+        finally:
+            job.running = False
@@ -0,0 +1,90 @@
+import asyncio
+from machine import Pin
+from time import ticks_ms, ticks_diff
+
+# Default software debounce per input pin
+DEBOUNCE_MS = 50
+
+
+class Sensor:
+    """ One debounced gate input. The IRQ handler only stamps the edge, the
+        level is confirmed by SensorBank once the pin has been quiet for
+        debounce_ms."""
+
+    def __init__(self, pin, name, flag, debounce_ms=DEBOUNCE_MS):
+        self.pin = pin
+        self.name = name
+        self.debounce_ms = debounce_ms
+        self.value = pin()
+        self.pending = False
+        self.edge_ms = ticks_ms()       # first edge of the current burst
+        self.last_ms = self.edge_ms     # most recent raw edge
+        self.changed_ms = self.edge_ms  # edge_ms of the last confirmed transition
+        self.edges = 0
+        self.latency_ms = 0             # last edge-to-publish latency
+        self.max_latency_ms = 0
+        self._flag = flag
+        pin.irq(self._irq, Pin.IRQ_RISING | Pin.IRQ_FALLING)
+
+    def _irq(self, pin):
+        # Runs in IRQ context: no allocation, just timestamps and a wakeup.
+        t = ticks_ms()
+        if not self.pending:
+            self.pending = True
+            self.edge_ms = t
+        self.last_ms = t
+        self.edges += 1
+        self._flag.set()
+
+    def published(self):
+        """ Note that the last transition has been reported."""
+        self.latency_ms = ticks_diff(ticks_ms(), self.changed_ms)
+        if self.latency_ms > self.max_latency_ms:
+            self.max_latency_ms = self.latency_ms
+        return self.latency_ms
+
+
+class SensorBank:
+    """ Edge triggered inputs. Iterate with 'async for sensor in bank' to get
+        each debounced transition as soon as it is confirmed."""
+
+    def __init__(self):
+        self.sensors = []
+        self._flag = asyncio.ThreadSafeFlag()
+        self._ready = []
+
+    def add(self, pin, name, debounce_ms=DEBOUNCE_MS):
+        sensor = Sensor(pin, name, self._flag, debounce_ms)
+        self.sensors.append(sensor)
+        return sensor
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self._ready:
+            await self._flag.wait()
+            await self._settle()
+            for s in self.sensors:
+                if s.pending:
+                    s.pending = False
+                    v = s.pin()
+                    if v != s.value:
+                        s.value = v
+                        s.changed_ms = s.edge_ms
+                        self._ready.append(s)
+        return self._ready.pop(0)
+
+    async def _settle(self):
+        # Sleep until every bouncing pin has been stable for its debounce time.
+        while True:
+            now = ticks_ms()
+            delay = 0
+            for s in self.sensors:
+                if s.pending:
+                    d = s.debounce_ms - ticks_diff(now, s.last_ms)
+                    if d > delay:
+                        delay = d
+            if delay <= 0:
+                return
+            await asyncio.sleep_ms(delay)
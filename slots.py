@@ -0,0 +1,132 @@
+import json
+import machine
+import os
+import sys
+
+# A/B code slots. The firmware runs from one slot directory; OTA updates
+# are written into the other one and take effect by switching the pointer
+# in STATE, a single rename. "" is the root, where the firmware lived
+# before the first slot update. Data files stay in the root.
+#
+# A new slot has to be confirmed (confirm(), MQTT connected and the gate
+# loop running) within CONFIRM_S of booting; otherwise the device resets.
+# After MAX_TRIES unconfirmed boots the previous slot is booted again, and
+# the version that failed is remembered so OTA doesn't install it again.
+#
+# boot.py calls boot(). This module and boot.py live in the root and are
+# not part of the OTA file list, so a bad update can't break the rollback.
+SLOTS = ('/slot_a', '/slot_b')
+STATE = '/slot.json'
+CONFIRM_S = 60
+MAX_TRIES = 2
+
+state = {
+    "active": "",       # slot directory the firmware runs from
+    "previous": "",     # slot to go back to
+    "confirmed": True,
+    "tries": 0,         # unconfirmed boots of the active slot
+    "rolled_back": "",  # slot given up on at the last rollback
+    "bad_version": 0,   # version of that slot, not installed again
+}
+
+_timer = None
+
+
+def _save():
+    with open(STATE + '.tmp', 'w') as f:
+        json.dump(state, f)
+    os.rename(STATE + '.tmp', STATE)
+
+
+def _expired(t):
+    machine.reset()
+
+
+def path(slot, name):
+    """ Absolute path of a firmware file in a slot."""
+    return slot + '/' + name
+
+
+def version(slot):
+    """ Firmware version in a slot, 0 if unknown."""
+    try:
+        with open(path(slot, 'version.json')) as f:
+            return int(json.load(f)['version'])
+    except (OSError, ValueError, KeyError):
+        return 0
+
+
+def inactive():
+    """ Slot an update is staged in."""
+    return SLOTS[1] if state["active"] == SLOTS[0] else SLOTS[0]
+
+
+def boot():
+    """ Select the slot to run, roll back if it failed to confirm too often
+        and arm the confirmation timer."""
+    global _timer
+    try:
+        with open(STATE) as f:
+            state.update(json.load(f))
+    except (OSError, ValueError):
+        pass
+    if not state["confirmed"]:
+        state["tries"] += 1
+        if state["tries"] > MAX_TRIES:
+            state["rolled_back"] = state["active"]
+            state["bad_version"] = max(state["bad_version"], version(state["active"]))
+            state["active"], state["previous"] = state["previous"], state["active"]
+            state["confirmed"] = True
+            state["tries"] = 0
+        _save()
+    if not state["confirmed"]:
+        _timer = machine.Timer(period=CONFIRM_S * 1000, mode=machine.Timer.ONE_SHOT,
+                               callback=_expired)
+    slot = state["active"]
+    # lib goes ahead of .frozen: lib/ntptime.py replaces the frozen ntptime
+    sys.path.insert(1, path(slot, 'lib'))
+    if slot:
+        # main.py is run from the current directory
+        os.chdir(slot)
+        sys.path.append('/')
+
+
+def confirm():
+    """ The running slot works. Returns the slot that was rolled back from,
+        if the previous boot did a rollback, else ''."""
+    global _timer
+    if _timer is not None:
+        _timer.deinit()
+        _timer = None
+    rolled_back = state["rolled_back"]
+    if not state["confirmed"] or rolled_back:
+        state["confirmed"] = True
+        state["tries"] = 0
+        state["rolled_back"] = ""
+        _save()
+    return rolled_back
+
+
+def commit(slot):
+    """ Boot from slot after the next reset, on probation."""
+    state["previous"] = state["active"]
+    state["active"] = slot
+    state["confirmed"] = False
+    state["tries"] = 0
+    state["rolled_back"] = ""
+    _save()
+
+
+def wipe(d):
+    """ Remove a directory tree (an old staging slot)."""
+    try:
+        entries = list(os.ilistdir(d))
+    except OSError:
+        return
+    for entry in entries:
+        p = d + '/' + entry[0]
+        if entry[1] == 0x4000:
+            wipe(p)
+        else:
+            os.remove(p)
+    os.rmdir(d)
@@ -0,0 +1,49 @@
+import gc
+import json
+from time import ticks_ms, ticks_diff
+
+# Snapshot of the controller state. The tasks that own a value update it in
+# place, /status only serializes it, so a request never touches flash.
+state = {
+    "open": 0,
+    "close": 0,
+    "objDTC": 0,
+    "last_cmd": None,
+    "last_cmd_time": None,
+    "uptime": 0,
+    "free": 0,
+    "rssi": None,
+    "rssi_range": None,
+    "version": 0,
+    "wifi": False,
+    "mqtt": False,
+    "cycles": None,
+    "clock": None,
+    "boot": {},     # boot stage -> ms since reset
+    "slot": None,   # firmware slot directory, see slots.py
+}
+
+_up_ms = 0
+_last = ticks_ms()
+
+try:
+    with open('version.json') as f:
+        state["version"] = int(json.load(f)['version'])
+except (OSError, ValueError, KeyError):
+    pass
+
+
+def refresh():
+    """ Update uptime and free memory. Called often enough (heartbeat) that
+        ticks_ms can't wrap in between."""
+    global _up_ms, _last
+    now = ticks_ms()
+    _up_ms += ticks_diff(now, _last)
+    _last = now
+    state["uptime"] = _up_ms // 1000
+    state["free"] = gc.mem_free()
+
+
+def dumps():
+    refresh()
+    return json.dumps(state).encode()
@@ -0,0 +1,66 @@
+import time
+from time import ticks_ms, ticks_diff
+import tz
+
+# Millisecond device time (UTC, the scale of time.time()) without reading
+# the RTC: ticks_ms anchored to the disciplined clock once attach() is
+# called, to the RTC second at import before that. Local time fields and
+# the 'Y-M-D H:M:S' text are cached per second.
+
+# Rebase the fallback anchor well within the ticks_ms half period
+REBASE_MS = 1 << 28
+
+_clock = None
+_anchor = ticks_ms()
+_base_ms = int(time.time()) * 1000
+
+_sec = None
+_tm = None
+_text = None
+
+
+def attach(clock):
+    """ Take the time from a clock.Clock (NTP disciplined, sub-second)."""
+    global _clock
+    _clock = clock
+
+
+def now_ms():
+    global _anchor, _base_ms
+    if _clock is not None:
+        return _clock.now_us() // 1000
+    now = ticks_ms()
+    e = ticks_diff(now, _anchor)
+    if e > REBASE_MS:
+        _base_ms += e
+        _anchor = now
+        e = 0
+    return _base_ms + e
+
+
+def at(t):
+    """ Device time in ms of ticks_ms value t (a recent one, e.g. an edge
+        stamped by an IRQ handler)."""
+    return now_ms() - ticks_diff(ticks_ms(), t)
+
+
+def localtime(sec):
+    """ tz.localtime(sec), the tuple is reused while the second is the same."""
+    global _sec, _tm, _text
+    if sec != _sec:
+        _sec = sec
+        _tm = tz.localtime(sec)
+        _text = None
+    return _tm
+
+
+def stamp(ms=None):
+    """ Local 'Y-M-D H:M:S' for device time ms (default now), built once
+        per second."""
+    global _text
+    if ms is None:
+        ms = now_ms()
+    tm = localtime(ms // 1000)
+    if _text is None:
+        _text = "{0}-{1}-{2} {3}:{4}:{5}".format(*tm)
+    return _text
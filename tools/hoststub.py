@@ -0,0 +1,151 @@
+""" Host (CPython) stand-ins for the MicroPython modules the firmware uses,
+    so that modules like sensors.py can be run and timed off-device.
+
+    import hoststub; hoststub.install()   # before importing firmware modules
+"""
+import asyncio
+import gc
+import io
+import os
+import sys
+import time
+import types
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+_TICKS_PERIOD = 1 << 30
+_TICKS_MAX = _TICKS_PERIOD - 1
+_TICKS_HALF = _TICKS_PERIOD // 2
+
+
+def ticks_ms():
+    return time.monotonic_ns() // 1000000 & _TICKS_MAX
+
+
+def ticks_us():
+    return time.monotonic_ns() // 1000 & _TICKS_MAX
+
+
+def ticks_add(t, delta):
+    return (t + delta) & _TICKS_MAX
+
+
+def ticks_diff(a, b):
+    return ((a - b + _TICKS_HALF) & _TICKS_MAX) - _TICKS_HALF
+
+
+class Pin:
+    """ Software pin. drive() changes the level and fires the IRQ handler
+        like a real edge would."""
+
+    IN = 0
+    OUT = 1
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+
+    def __init__(self, id, mode=IN, pull=None, value=0):
+        self.id = id
+        self.mode = mode
+        self._value = value
+        self._handler = None
+        self._trigger = 0
+        self.history = []  # (ticks_ms, level) for every level change
+
+    def __call__(self, value=None):
+        if value is None:
+            return self._value
+        self.drive(value)
+
+    value = __call__
+
+    def on(self):
+        self.drive(1)
+
+    def off(self):
+        self.drive(0)
+
+    def irq(self, handler=None, trigger=IRQ_FALLING | IRQ_RISING, hard=False):
+        self._handler = handler
+        self._trigger = trigger
+
+    def drive(self, value):
+        value = 1 if value else 0
+        if value == self._value:
+            return
+        self._value = value
+        self.history.append((ticks_ms(), value))
+        edge = self.IRQ_RISING if value else self.IRQ_FALLING
+        if self._handler and self._trigger & edge:
+            self._handler(self)
+
+
+class ThreadSafeFlag:
+    def __init__(self):
+        self._evt = asyncio.Event()
+
+    def set(self):
+        self._evt.set()
+
+    def clear(self):
+        self._evt.clear()
+
+    async def wait(self):
+        await self._evt.wait()
+        self._evt.clear()
+
+
+async def readinto(self, buf):
+    """ MicroPython's Stream.readinto() for asyncio.StreamReader."""
+    data = await self.read(len(buf))
+    buf[:len(data)] = data
+    return len(data)
+
+
+def ilistdir(path="."):
+    """ MicroPython's os.ilistdir(): (name, type, inode) tuples."""
+    for e in os.scandir(path):
+        yield e.name, 0x4000 if e.is_dir() else 0x8000, e.inode()
+
+
+async def sleep_ms(ms):
+    await asyncio.sleep(ms / 1000)
+
+
+def install():
+    """ Register the stand-ins and put the firmware on sys.path."""
+    for p in (ROOT, os.path.join(ROOT, "lib")):
+        if p not in sys.path:
+            sys.path.insert(0, p)
+
+    time.ticks_ms = ticks_ms
+    time.ticks_us = ticks_us
+    time.ticks_add = ticks_add
+    time.ticks_diff = ticks_diff
+
+    if not hasattr(gc, "mem_free"):
+        gc.mem_free = lambda: 200000
+        gc.mem_alloc = lambda: 64000
+
+    if not hasattr(os, "ilistdir"):
+        os.ilistdir = ilistdir
+
+    asyncio.ThreadSafeFlag = ThreadSafeFlag
+    asyncio.sleep_ms = sleep_ms
+    asyncio.StreamReader.readinto = readinto
+    sys.modules.setdefault("uasyncio", asyncio)
+    sys.modules.setdefault("uio", io)
+    sys.modules.setdefault("utime", time)
+
+    machine = types.ModuleType("machine")
+    machine.Pin = Pin
+    machine.reset = lambda: None
+    machine.unique_id = lambda: b"\x00host\x00"
+    sys.modules.setdefault("machine", machine)
+
+    micropython = types.ModuleType("micropython")
+    micropython.const = lambda x: x
+    micropython.schedule = lambda fn, arg: fn(arg)
+    sys.modules.setdefault("micropython", micropython)
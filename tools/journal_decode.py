@@ -0,0 +1,60 @@
+""" Decode the binary event journal (journal.bin) copied from the Pico.
+
+    python tools/journal_decode.py [--csv] [--local] journal.bin [journal.bin.1 ...]
+
+Files are printed in the order given; pass journal.bin.1 first to get the
+older records first. Times are UTC, --local converts them to this PC's
+time zone.
+"""
+import datetime
+import struct
+import sys
+
+FORMAT = "<IHBB"
+SIZE = struct.calcsize(FORMAT)
+
+NAMES = ("EPOCH", "POWER_UP", "GATE_OPEN", "GATE_CLOSE", "OBJECT", "COMMAND", "WIFI", "NTP_SYNC")
+COMMANDS = ("", "open", "close", "stop")
+EPOCH, COMMAND = 0, 5
+
+
+def records(path):
+    """ Yield (datetime, event name, payload) for every record in a file."""
+    epoch = datetime.datetime(1970, 1, 1)
+    with open(path, "rb") as f:
+        data = f.read()
+    for i in range(0, len(data) - SIZE + 1, SIZE):
+        t, ms, code, payload = struct.unpack_from(FORMAT, data, i)
+        if code == EPOCH:
+            epoch = datetime.datetime(1970 + payload, 1, 1)
+            continue
+        when = epoch + datetime.timedelta(seconds=t, milliseconds=ms)
+        name = NAMES[code] if code < len(NAMES) else "?%d" % code
+        if code == COMMAND and payload < len(COMMANDS):
+            payload = COMMANDS[payload]
+        yield when, name, payload
+
+
+def main(argv):
+    csv = "--csv" in argv
+    local = "--local" in argv
+    paths = [a for a in argv if a not in ("--csv", "--local")]
+    if not paths:
+        print(__doc__.strip())
+        return 2
+    if csv:
+        print("time,event,payload")
+    for path in paths:
+        for when, name, payload in records(path):
+            if local:
+                when = when.replace(tzinfo=datetime.timezone.utc).astimezone().replace(tzinfo=None)
+            stamp = when.isoformat(sep=" ", timespec="milliseconds")
+            if csv:
+                print(f"{stamp},{name},{payload}")
+            else:
+                print(f"{stamp} {name:<10} {payload}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
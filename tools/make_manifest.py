@@ -0,0 +1,50 @@
+""" Write manifest.json for a release: path, size and SHA-256 of every file
+    the OTA updater ships.
+
+    python tools/make_manifest.py [file ...]
+
+Without arguments the files listed in the OTAUpdater(...) call in main.py
+are used. The version is taken from version.json.
+"""
+import hashlib
+import json
+import os
+import re
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+
+def ota_files(root=ROOT):
+    """ The file list of the OTAUpdater(...) call in main.py."""
+    with open(os.path.join(root, "main.py")) as f:
+        src = f.read()
+    call = src[src.index("OTAUpdater(firmware_url"):]
+    call = call[:call.index(")")]
+    return re.findall(r'"([^"]+)"', call)
+
+
+def entry(root, path):
+    with open(os.path.join(root, path), "rb") as f:
+        data = f.read()
+    return {"path": path, "size": len(data), "sha256": hashlib.sha256(data).hexdigest()}
+
+
+def build(root=ROOT, paths=None):
+    with open(os.path.join(root, "version.json")) as f:
+        version = int(json.load(f)["version"])
+    return {"version": version, "files": [entry(root, p) for p in paths or ota_files(root)]}
+
+
+def write(root=ROOT, paths=None):
+    manifest = build(root, paths)
+    with open(os.path.join(root, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
+
+
+if __name__ == "__main__":
+    m = write(paths=sys.argv[1:])
+    print(f"manifest.json: version {m['version']}, {len(m['files'])} files, "
+          f"{sum(e['size'] for e in m['files'])} bytes")
@@ -0,0 +1,89 @@
+""" Local NTP stand-in servers for lib/ntptime.py's async client.
+
+    python tools/ntp_standin.py             # self-check against 3 stand-ins
+    python tools/ntp_standin.py serve PORT [OFFSET_MS] [DELAY_MS]
+
+Each stand-in answers with the host clock shifted by OFFSET_MS behind a
+simulated network path with DELAY_MS round trip (half each way), so the
+client's offset/delay arithmetic and its choice of the best server can be
+checked. One stand-in never answers.
+"""
+import asyncio
+import struct
+import sys
+import time
+
+import hoststub
+
+hoststub.install()
+
+import ntptime  # noqa: E402
+
+NTP_DELTA = 2208988800
+# (port, offset_ms, delay_ms), None delay = never answers
+STANDINS = ((12301, 250, 40), (12302, 250, 5), (12303, 250, None))
+
+
+def ntp_stamp(t):
+    sec = int(t)
+    return sec + NTP_DELTA, int((t - sec) * (1 << 32)) & 0xffffffff
+
+
+class Standin(asyncio.DatagramProtocol):
+
+    def __init__(self, offset_ms, delay_ms):
+        self.offset = offset_ms / 1000
+        self.delay = delay_ms
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if self.delay is None:
+            return
+        asyncio.get_running_loop().call_later(self.delay / 2000, self.reply, addr)
+
+    def reply(self, addr):
+        msg = bytearray(48)
+        msg[0] = 0x24  # LI 0, version 4, mode 4 (server)
+        msg[1] = 2     # stratum
+        struct.pack_into("!II", msg, 32, *ntp_stamp(time.time() + self.offset))
+        struct.pack_into("!II", msg, 40, *ntp_stamp(time.time() + self.offset))
+        asyncio.get_running_loop().call_later(self.delay / 2000, self.transport.sendto, msg, addr)
+
+
+async def start(port, offset_ms, delay_ms):
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: Standin(offset_ms, delay_ms), local_addr=("127.0.0.1", port))
+    return transport
+
+
+async def check():
+    for port, offset, delay in STANDINS:
+        await start(port, offset, delay)
+    names = [f"127.0.0.1:{port}" for port, _, _ in STANDINS]
+    for name in names:
+        r = await ntptime.query(name, 500)
+        print(f"{name:18} {'no answer' if r is None else f'offset {r[0] / 1000:8.1f} ms  delay {r[1] / 1000:6.1f} ms'}")
+    t = time.monotonic()
+    best = await ntptime.sample(names, 500)
+    print(f"best: {best[2]} offset {best[0] / 1000:.1f} ms delay {best[1] / 1000:.1f} ms"
+          f" ({(time.monotonic() - t) * 1000:.0f} ms for {len(names)} servers)")
+    ok = best[2] == names[1] and abs(best[0] / 1000 - STANDINS[1][1]) < 20
+    print("OK" if ok else "FAIL")
+    return ok
+
+
+async def serve(port, offset_ms, delay_ms):
+    await start(port, offset_ms, delay_ms)
+    print(f"NTP stand-in on 127.0.0.1:{port}, offset {offset_ms} ms, delay {delay_ms} ms")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["serve"]:
+        args = [int(a) for a in sys.argv[2:5]]
+        asyncio.run(serve(*(args + [0, 0][len(args) - 1:])))
+    else:
+        sys.exit(0 if asyncio.run(check()) else 1)
@@ -0,0 +1,163 @@
+""" Compare full and manifest (delta) OTA updates against a local HTTP
+    stand-in for the GitHub repository.
+
+    python tools/ota_bench.py
+
+For a release that changes one file and one that changes every file, the
+updater runs in a scratch "device" directory in both modes, staging the
+update in its slot_a. Prints the bytes
+served, the update time and the worst lag a 10 ms ticker task (standing in
+for the gate loop) saw meanwhile, and checks the slot holds the release and
+is committed.
+"""
+import asyncio
+import http.server
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import hoststub
+
+hoststub.install()
+
+import make_manifest  # noqa: E402
+import ota  # noqa: E402
+import slots  # noqa: E402
+
+
+class Handler(http.server.SimpleHTTPRequestHandler):
+    sent = 0
+
+    def copyfile(self, source, outputfile):
+        data = source.read()
+        Handler.sent += len(data)
+        outputfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(root):
+    handler = lambda *a, **k: Handler(*a, directory=root, **k)  # noqa: E731
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def release(repo, files, changed, version, stale=False):
+    """ Copy the firmware to repo, change the 'changed' files, bump version.
+        With stale the manifest is left at the previous release's."""
+    for path in files:
+        dst = os.path.join(repo, path)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        shutil.copy(os.path.join(make_manifest.ROOT, path), dst)
+    if stale:
+        with open(os.path.join(repo, "version.json"), "w") as f:
+            json.dump({"version": version - 1}, f)
+        make_manifest.write(repo, files)
+    for path in files:
+        dst = os.path.join(repo, path)
+        if path in changed:
+            with open(dst, "a") as f:
+                f.write(f"\n# release {version}\n")
+    with open(os.path.join(repo, "version.json"), "w") as f:
+        json.dump({"version": version}, f)
+    if not stale:
+        make_manifest.write(repo, files)
+
+
+def device(dev, files):
+    """ A device running the current firmware, version 1."""
+    for path in files:
+        dst = os.path.join(dev, path)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        shutil.copy(os.path.join(make_manifest.ROOT, path), dst)
+    with open(os.path.join(dev, "version.json"), "w") as f:
+        json.dump({"version": 1}, f)
+
+
+async def ticker(lag):
+    while True:
+        t = time.perf_counter()
+        await asyncio.sleep(0.01)
+        lag[0] = max(lag[0], time.perf_counter() - t - 0.01)
+
+
+async def update(url, files, manifest):
+    lag = [0]
+    task = asyncio.create_task(ticker(lag))
+    updater = ota.OTAUpdater(url, *files, manifest=manifest)
+    await updater.download_and_install_update_if_available()
+    task.cancel()
+    return lag[0]
+
+
+def run(url, dev, files, manifest):
+    """ Update a device running from 'dev', staging in dev/slot_a."""
+    cwd = os.getcwd()
+    os.chdir(dev)
+    slots.SLOTS = (os.path.join(dev, "slot_a"), os.path.join(dev, "slot_b"))
+    slots.STATE = os.path.join(dev, "slot.json")
+    slots.state["active"] = dev
+    out = sys.stdout
+    sys.stdout = open(os.devnull, "w")  # the updater is chatty
+    try:
+        Handler.sent = 0
+        t = time.perf_counter()
+        lag = asyncio.run(update(url, files, manifest))
+        return Handler.sent, time.perf_counter() - t, lag
+    finally:
+        sys.stdout.close()
+        sys.stdout = out
+        os.chdir(cwd)
+
+
+def committed(repo, dev, files):
+    """ The release is in the staged slot and the slot pointer points at it."""
+    with open(slots.STATE) as f:
+        if json.load(f)["active"] != slots.SLOTS[0]:
+            return False
+    dev = slots.SLOTS[0]
+    for path in files + ["version.json"]:
+        with open(os.path.join(repo, path), "rb") as a, open(os.path.join(dev, path), "rb") as b:
+            if a.read() != b.read():
+                return False
+    return True
+
+
+def main():
+    files = make_manifest.ota_files()
+    ok = True
+    with tempfile.TemporaryDirectory() as tmp:
+        repo = os.path.join(tmp, "repo")
+        server = serve(repo)
+        url = f"http://127.0.0.1:{server.server_port}/"
+        print(f"{len(files)} files\n")
+        print(f"{'release':12} {'mode':9} {'bytes':>8} {'ms':>8} {'lag ms':>7}")
+        releases = (("one file", {"main.py"}, False),
+                    ("lib only", {"lib/logging/handlers.py"}, False),
+                    ("all files", set(files), False),
+                    ("stale manif.", {"main.py"}, True))
+        for name, changed, stale in releases:
+            release(repo, files, changed, 2, stale)
+            for manifest in (False, True):
+                dev = os.path.join(tmp, "dev")
+                shutil.rmtree(dev, ignore_errors=True)
+                device(dev, files)
+                sent, secs, lag = run(url, dev, files, manifest)
+                good = committed(repo, dev, files)
+                ok = ok and good
+                print(f"{name:12} {'manifest' if manifest else 'full':9} {sent:8} {secs * 1000:8.1f}"
+                      f" {lag * 1000:7.1f}"
+                      f"{'' if good else '  MISMATCH'}")
+            shutil.rmtree(repo)
+        server.shutdown()
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,65 @@
+""" Check datalog.rotate() on the host.
+
+    python tools/rotate_check.py
+
+Rotates a data file with short, long (over LINE_MAX and BLOCK) and '@' lines,
+with and without a final newline, and compares debug.log with the expected
+lines.
+"""
+import os
+import sys
+import tempfile
+
+import hoststub
+
+hoststub.install()
+
+import datalog  # noqa: E402
+
+HEADER = "Time,Open,Closed\n"
+
+
+def root(tmp):
+    """ Put the data files in tmp instead of the root."""
+    for name in ("DATAFILENAME", "LOGFILENAME", "ERRORLOGFILENAME", "TMPFILENAME"):
+        setattr(datalog, name, os.path.join(tmp, getattr(datalog, name).lstrip("/")))
+    datalog.FILES = [datalog.DATAFILENAME, datalog.ERRORLOGFILENAME]
+
+
+def case(lines):
+    data = "".join(lines)
+    for path in (datalog.DATAFILENAME, datalog.LOGFILENAME):
+        if os.path.exists(path):
+            os.remove(path)
+    with open(datalog.DATAFILENAME, "w") as f:
+        f.write(data)
+    datalog.rotate(HEADER)
+    with open(datalog.LOGFILENAME) as f:
+        log = f.read()
+    with open(datalog.DATAFILENAME) as f:
+        new = f.read()
+    want = "".join(line for line in lines if "@" not in line)
+    return log == want and new == HEADER
+
+
+def main():
+    short = "2026-10-18 12:0:0,1,0\n"
+    cases = {
+        "short lines": [HEADER, short, "@ 2026-10-18 12:0:1 note\n", short],
+        "line over LINE_MAX": [short, "A" * (datalog.LINE_MAX + 40) + "\n", short],
+        "line over BLOCK": [short, "B" * (3 * datalog.BLOCK + 7) + "\n", short],
+        "no final newline": [short, "C" * (datalog.LINE_MAX * 2)],
+        "long '@' line": [short, "@" + "D" * (datalog.LINE_MAX * 2) + "\n", short],
+    }
+    ok = True
+    with tempfile.TemporaryDirectory() as tmp:
+        root(tmp)
+        for name, lines in cases.items():
+            good = case(lines)
+            ok = ok and good
+            print(f"{name:20} {'ok' if good else 'MISMATCH'}")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,59 @@
+""" Measure edge-to-publish latency of sensors.py on the host.
+
+    python tools/sensor_latency.py [cycles]
+
+Each cycle drives a bouncing edge on one of three stub pins and "publishes"
+the debounced transition the way comm() does.
+"""
+import asyncio
+import random
+import sys
+
+import hoststub
+
+hoststub.install()
+
+from sensors import SensorBank  # noqa: E402
+
+BOUNCES = 4
+BOUNCE_MS = 2
+
+
+async def drive(pins, cycles):
+    for i in range(cycles):
+        pin = random.choice(pins)
+        level = not pin()
+        for _ in range(BOUNCES):
+            pin.drive(level)
+            await asyncio.sleep(BOUNCE_MS / 1000)
+            pin.drive(not level)
+            await asyncio.sleep(BOUNCE_MS / 1000)
+        pin.drive(level)
+        await asyncio.sleep(0.15)
+
+
+async def publish(bank, latencies):
+    async for sensor in bank:
+        await asyncio.sleep(0)  # stands in for client.publish()
+        latencies.append(sensor.published())
+
+
+async def run(cycles):
+    bank = SensorBank()
+    pins = [hoststub.Pin(n) for n in (16, 17, 18)]
+    for pin, name in zip(pins, ("open", "close", "objDTC")):
+        bank.add(pin, name)
+    latencies = []
+    task = asyncio.create_task(publish(bank, latencies))
+    await drive(pins, cycles)
+    task.cancel()
+    edges = sum(s.edges for s in bank.sensors)
+    print(f"{cycles} transitions, {edges} raw edges, {len(latencies)} published")
+    if latencies:
+        latencies.sort()
+        print("edge-to-publish ms: min %d  median %d  max %d" % (
+            latencies[0], latencies[len(latencies) // 2], latencies[-1]))
+
+
+if __name__ == "__main__":
+    asyncio.run(run(int(sys.argv[1]) if len(sys.argv) > 1 else 20))
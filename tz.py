@@ -0,0 +1,75 @@
+import time
+from array import array
+
+# Central European Time with EU summer time: UTC+1, UTC+2 from 01:00 UTC on
+# the last Sunday of March until 01:00 UTC on the last Sunday of October.
+STD = 3600
+DST = 7200
+# Years covered by the transition table, later years are computed on the fly
+FIRST_YEAR = 2024
+YEARS = 30
+
+
+def _days(y, m, d):
+    # Days from 1970-01-01 to y-m-d (proleptic Gregorian)
+    if m < 3:
+        y -= 1
+        m += 12
+    return 365 * y + y // 4 - y // 100 + y // 400 + (153 * (m - 3) + 2) // 5 + d - 719469
+
+
+_EPOCH = _days(time.gmtime(0)[0], 1, 1)
+
+
+def _last_sunday(y, m):
+    # Transition instant (01:00 UTC) on the last Sunday of month m
+    d = _days(y, m, 31)
+    d -= (d + 4) % 7  # 1970-01-01 was a Thursday
+    return (d - _EPOCH) * 86400 + 3600
+
+
+def _year(y):
+    return _last_sunday(y, 3), _last_sunday(y, 10)
+
+
+# Start and end of summer time for every year, in UTC seconds since the epoch
+_table = array('L')
+for _y in range(FIRST_YEAR, FIRST_YEAR + YEARS):
+    _table.extend(_year(_y))
+del _y
+
+
+def offset(t):
+    """ Seconds to add to UTC time t for local time."""
+    lo, hi = 0, len(_table)
+    if t < _table[0] or t >= _table[-1]:
+        start, end = _year(time.gmtime(t)[0])
+        return DST if start <= t < end else STD
+    # Number of transitions at or before t, odd means summer time
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if _table[mid] <= t:
+            lo = mid + 1
+        else:
+            hi = mid
+    return DST if lo & 1 else STD
+
+
+def localtime(t=None):
+    """ time.localtime() for UTC time t (default now, the RTC runs on UTC)."""
+    if t is None:
+        t = time.time()
+    t = int(t)
+    return time.gmtime(t + offset(t))
+
+
+def timegm(tm):
+    """ UTC seconds since the epoch of a (y, m, d, h, m, s, ...) UTC tuple."""
+    return (_days(tm[0], tm[1], tm[2]) - _EPOCH) * 86400 + tm[3] * 3600 + tm[4] * 60 + tm[5]
+
+
+def mktime(tm):
+    """ UTC seconds of a local time tuple. In the hour that repeats when
+        summer time ends, the first (summer time) occurrence is returned."""
+    t = timegm(tm)
+    return t - offset(t - DST)
@@ -0,0 +1,450 @@
+import asyncio
+import gc
+import os
+import sys
+import time
+import datalog
+from datalog import DATAFILENAME, LOGFILENAME, ERRORLOGFILENAME, error, line_time
+import journal
+from log import logger
+import metrics
+import status
+
+# Admission control: at most MAX_CLIENTS connections are served at once,
+# others get a 503. Timeouts are in seconds.
+MAX_CLIENTS = 3
+REQUEST_TIMEOUT = 5   # request line and headers of a new connection
+IDLE_TIMEOUT = 10     # keep-alive connection waiting for its next request
+WRITE_TIMEOUT = 10    # each drain of the response
+MAX_REQUESTS = 20     # requests served over one keep-alive connection
+
+# Files are sent in chunks of this size through one preallocated buffer, so a
+# request needs a few KB of RAM whatever the size of the file.
+CHUNK = 512
+
+HEAD = """<!DOCTYPE html>
+<html>
+    <head> <title>Gate controller</title> </head>
+    <body> <h1>Entrance gate control</h1>
+        <h3>%s</h3>
+        <h4>%s</h4>
+        <pre>"""
+TAIL = b"""</pre>
+    </body>
+</html>
+"""
+
+# path -> (file, heading), anything else shows the data file
+PAGES = {
+    '/log': (LOGFILENAME, "Debug"),
+    '/err': (ERRORLOGFILENAME, "ERRORS"),
+}
+INDEX = (DATAFILENAME, "Append '/log', '/err' or '/journal' to URL to see log file, error log or events"
+                       " (?tail=N for the last N lines, on /log and /err ?since=-S for the last S seconds)")
+
+DAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+MONTHS = ("Jan", "Feb", "Mar", "Apr", "May", "Jun",
+          "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+# Request headers that are kept, all others are skipped
+HEADERS = (b"range", b"if-none-match", b"if-modified-since", b"connection")
+
+VERSION = f"MicroPython Version: {sys.version}"
+_heads = {}  # heading -> rendered page head
+
+# counters
+clients = 0
+served = 0
+rejected = 0
+timeouts = 0
+
+_buf = bytearray(CHUNK)
+_mv = memoryview(_buf)
+_head = bytearray(24)  # start of a line, enough for its timestamp
+
+
+def page(path):
+    for p in PAGES:
+        if p in path:
+            return PAGES[p]
+    return INDEX
+
+
+def query(target):
+    """ Split a request target into path and a dict of query arguments."""
+    path, _, qs = target.partition('?')
+    args = {}
+    for kv in qs.split('&'):
+        if kv:
+            k, _, v = kv.partition('=')
+            args[k] = v
+    return path, args
+
+
+def filestat(filename):
+    """ (size, mtime) of a file, (0, 0) if it doesn't exist."""
+    try:
+        st = os.stat(filename)
+        return st[6], st[8]
+    except OSError:
+        return 0, 0
+
+
+def etag(size, mtime):
+    # datalog.appends changes with lines still waiting in the RAM buffer
+    return f'W/"{size:x}-{mtime:x}-{datalog.appends:x}"'
+
+
+def http_date(t):
+    tm = time.gmtime(t)
+    return "%s, %02d %s %d %02d:%02d:%02d GMT" % (
+        DAYS[tm[6]], tm[2], MONTHS[tm[1] - 1], tm[0], tm[3], tm[4], tm[5])
+
+
+def head(heading):
+    """ Rendered page head, cached per heading."""
+    h = _heads.get(heading)
+    if h is None:
+        h = (HEAD % (heading, VERSION)).encode()
+        _heads[heading] = h
+    return h
+
+
+def line_starts(f, size):
+    """ Yield the offset of every line in the file, last line first. The
+        file is read backwards in CHUNK sized blocks."""
+    pos = size
+    while pos > 0:
+        start = pos - CHUNK if pos > CHUNK else 0
+        f.seek(start)
+        n = f.readinto(_mv[:pos - start])
+        for i in range(n - 1, -1, -1):
+            if _buf[i] == 10 and start + i + 1 < size:
+                yield start + i + 1
+        pos = start
+    yield 0
+
+
+def tail_offset(filename, size, lines):
+    """ Offset of the last 'lines' lines."""
+    offset = size
+    if lines > 0:
+        with open(filename, 'rb') as f:
+            for offset in line_starts(f, size):
+                lines -= 1
+                if not lines:
+                    break
+    return offset
+
+
+def since_offset(filename, size, t):
+    """ Offset of the first line stamped at or after t. Lines without a
+        timestamp stay with the line above them."""
+    offset = size
+    with open(filename, 'rb') as f:
+        for start in line_starts(f, size):
+            f.seek(start)
+            n = f.readinto(_head)
+            stamp = line_time(bytes(_head[:n]))
+            if stamp is None:
+                continue
+            if stamp < t:
+                break
+            offset = start
+    return offset
+
+
+def parse_since(value):
+    """ '-S' is S seconds ago, otherwise a 'Y-M-DTH:M[:S]' local time.
+        None if it is neither."""
+    if value.startswith('-'):
+        return time.time() - int(value[1:]) if value[1:].isdigit() else None
+    return line_time(value.replace('T', ' ').encode())
+
+
+def byte_range(spec, size):
+    """ (start, end) for a 'bytes=a-b' Range value, end exclusive. None if
+        the range can't be satisfied."""
+    if not spec.startswith(b'bytes='):
+        return None
+    try:
+        a, _, b = spec[6:].split(b',')[0].partition(b'-')
+        if a:
+            start = int(a)
+            end = int(b) + 1 if b else size
+        else:
+            start = size - int(b)
+            end = size
+    except ValueError:
+        return None
+    if start < 0:
+        start = 0
+    if end > size:
+        end = size
+    if start >= end:
+        return None
+    return start, end
+
+
+async def drain(writer):
+    await asyncio.wait_for(writer.drain(), WRITE_TIMEOUT)
+
+
+def reply(writer, code, keep, hdrs=""):
+    """ Write the status line and headers, hdrs is a preformatted block."""
+    writer.write(f"HTTP/1.1 {code}\r\nConnection: {'keep-alive' if keep else 'close'}\r\n"
+                 f"{hdrs}\r\n".encode())
+
+
+async def send_file(writer, filename, start=0, end=None):
+    """ Stream a file (or part of it) to the client, one buffer at a time."""
+    with open(filename, 'rb') as f:
+        if start:
+            f.seek(start)
+        left = end - start if end is not None else -1
+        while left:
+            n = f.readinto(_buf if left < 0 or left >= CHUNK else _mv[:left])
+            if not n:
+                break
+            writer.write(_mv[:n])
+            await drain(writer)
+            if left > 0:
+                left -= n
+
+
+async def send_range(writer, filename, size, spec, keep):
+    """ Raw file bytes for a Range request."""
+    r = byte_range(spec, size)
+    if r is None:
+        reply(writer, "416 Range Not Satisfiable", keep,
+              f"Content-Range: bytes */{size}\r\nContent-Length: 0\r\n")
+        return
+    start, end = r
+    reply(writer, "206 Partial Content", keep,
+          f"Content-type: text/plain\r\nContent-Range: bytes {start}-{end - 1}/{size}\r\n"
+          f"Content-Length: {end - start}\r\n")
+    await send_file(writer, filename, start, end)
+
+
+async def send_journal(writer, keep, args):
+    """ The binary event journal rendered as text, one line per record."""
+    size = filestat(journal.JOURNALFILENAME)[0]
+    size -= size % journal.SIZE
+    waiting = bytearray()
+    for c in datalog.pending(journal.JOURNALFILENAME):
+        waiting += c
+    total = (size + len(waiting)) // journal.SIZE
+    first = 0
+    if 'tail' in args:
+        first = min(total, max(0, total - int(args['tail'])))
+
+    h = head("Events")
+    reply(writer, "200 OK", keep,
+          f"Content-type: text/html\r\nCache-Control: no-cache\r\n"
+          f"Content-Length: {len(h) + (total - first) * journal.LINE + len(TAIL)}\r\n")
+    writer.write(h)
+    pos = first * journal.SIZE
+    if pos < size:
+        with open(journal.JOURNALFILENAME, 'rb') as f:
+            f.seek(pos)
+            while pos < size:
+                n = f.readinto(_buf if size - pos >= CHUNK else _mv[:size - pos])
+                if not n:
+                    break
+                n -= n % journal.SIZE
+                for i in range(0, n, journal.SIZE):
+                    writer.write(journal.render(_mv[i:i + journal.SIZE]).encode())
+                await drain(writer)
+                pos += n
+                f.seek(pos)
+    for i in range(pos - size, len(waiting), journal.SIZE):
+        writer.write(journal.render(waiting[i:i + journal.SIZE]).encode())
+    writer.write(TAIL)
+    await drain(writer)
+
+
+async def read_request(reader):
+    """ Request line and the headers listed in HEADERS."""
+    request_line = await reader.readline()
+    hdrs = {}
+    while request_line:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.partition(b":")
+        name = name.strip().lower()
+        if name in HEADERS:
+            hdrs[name] = value.strip()
+    return request_line, hdrs
+
+
+def count_arg(args, name):
+    """ Whether ?name= is absent or a whole number (>= 0)."""
+    value = args.get(name)
+    return value is None or value.isdigit()
+
+
+async def bad_request(writer, keep):
+    reply(writer, "400 Bad Request", keep, "Content-Length: 0\r\n")
+    await drain(writer)
+    return keep
+
+
+def metrics_per(args):
+    """ The ?per= of /metrics, None unless it is 1..metrics.SIZE."""
+    try:
+        per = int(args.get('per', 1))
+    except ValueError:
+        return None
+    return per if 1 <= per <= metrics.SIZE else None
+
+
+def keep_alive(request_line, hdrs):
+    conn = hdrs.get(b"connection", b"").lower()
+    if request_line.rstrip().endswith(b"HTTP/1.1"):
+        return conn != b"close"
+    return conn == b"keep-alive"
+
+
+async def handle(reader, writer, timeout, keep):
+    """ Serve one request. Returns whether the connection stays open, None if
+        the client closed it."""
+    request_line, hdrs = await asyncio.wait_for(read_request(reader), timeout)
+    if not request_line:
+        return None
+    print("Request:", request_line)
+    keep = keep and keep_alive(request_line, hdrs)
+
+    path, args = query(request_line.split()[1].decode())
+    if path in ('/status', '/metrics'):
+        if path == '/status':
+            body = status.dumps()
+        else:
+            per = metrics_per(args)
+            if per is None:
+                return await bad_request(writer, keep)
+            body = metrics.dumps(per).encode()
+        reply(writer, "200 OK", keep,
+              f"Content-type: application/json\r\nCache-Control: no-store\r\n"
+              f"Content-Length: {len(body)}\r\n")
+        writer.write(body)
+        await drain(writer)
+        return keep
+    if path == '/journal':
+        if not count_arg(args, 'tail'):
+            return await bad_request(writer, keep)
+        await send_journal(writer, keep, args)
+        return keep
+
+    filename, heading = page(path)
+    since = None
+    if 'since' in args:
+        since = parse_since(args['since'])
+    if not count_arg(args, 'tail') or ('since' in args and since is None):
+        return await bad_request(writer, keep)
+    size, mtime = filestat(filename)
+
+    rng = hdrs.get(b"range")
+    if rng is not None:
+        await send_range(writer, filename, size, rng, keep)
+        await drain(writer)
+        return keep
+
+    # Pages relative to the current time can't be revalidated
+    validators = ""
+    if not args.get('since', '').startswith('-'):
+        tag = etag(size, mtime)
+        modified = http_date(mtime) if mtime else None
+        # If-Modified-Since only counts without If-None-Match (RFC 7232 6)
+        match = hdrs.get(b"if-none-match")
+        if match is not None:
+            fresh = match == tag.encode()
+        else:
+            fresh = modified and hdrs.get(b"if-modified-since") == modified.encode()
+        if fresh:
+            reply(writer, "304 Not Modified", keep, f"ETag: {tag}\r\n")
+            await drain(writer)
+            return keep
+        validators = f"ETag: {tag}\r\n"
+        if modified:
+            validators += f"Last-Modified: {modified}\r\n"
+
+    start = 0
+    if 'tail' in args:
+        start = tail_offset(filename, size, int(args['tail']))
+    elif since is not None:
+        start = since_offset(filename, size, since)
+
+    gc.collect()
+    # Lines still waiting in the RAM buffer are copied now, the writer task
+    # may move them to the file while the flushed part is being sent.
+    waiting = bytearray()
+    if filename in datalog.FILES:
+        for c in datalog.pending(filename):
+            waiting += c
+    free = f"free: {gc.mem_free()}\n".encode()
+    h = head(heading)
+
+    reply(writer, "200 OK", keep,
+          f"Content-type: text/html\r\nAccept-Ranges: bytes\r\nCache-Control: no-cache\r\n"
+          f"Content-Length: {len(h) + size - start + len(waiting) + len(free) + len(TAIL)}\r\n{validators}")
+    writer.write(h)
+    await drain(writer)
+    # Stop at the size announced above even if the file grows meanwhile.
+    # A missing file (no errors logged yet) is served as empty.
+    if start < size:
+        await send_file(writer, filename, start, size)
+    writer.write(waiting)
+    writer.write(free)
+    writer.write(TAIL)
+    await drain(writer)
+    return keep
+
+
+async def serve_client(reader, writer):
+    global clients, served, rejected, timeouts
+
+    if clients >= MAX_CLIENTS:
+        rejected += 1
+        try:
+            # Take the request off the socket first, closing with unread
+            # data would reset the connection before the client sees the 503.
+            await asyncio.wait_for(read_request(reader), 1)
+            reply(writer, "503 Service Unavailable", False, "Retry-After: 2\r\nContent-Length: 0\r\n")
+            await drain(writer)
+        except Exception:
+            pass
+        await close(writer)
+        return
+
+    clients += 1
+    try:
+        print("Client connected")
+        for n in range(MAX_REQUESTS):
+            try:
+                keep = await handle(reader, writer, IDLE_TIMEOUT if n else REQUEST_TIMEOUT,
+                                    n < MAX_REQUESTS - 1)
+            except asyncio.TimeoutError:
+                # An idle keep-alive connection timing out is normal
+                if not n:
+                    timeouts += 1
+                break
+            if keep is None:
+                break
+            served += 1
+            if not keep:
+                break
+        logger.debug("Client disconnected")
+    except Exception as e:
+        error(f"serve_client error: {str(e)}")
+    finally:
+        clients -= 1
+        await close(writer)
+
+
+async def close(writer):
+    try:
+        writer.close()
+        await writer.wait_closed()
+    except OSError:
+        pass